@@ -0,0 +1,198 @@
+import fcntl
+import os
+import shutil
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import classes
+import jobs
+import progress
+import quota
+import siteindex
+
+# Uploads every bulletin date that has no sermon on the website yet. Each sermon
+# moves through three bounded stage pools: downloads (network), trimming and
+# noise reduction (CPU) and uploads, so one sermon can be uploading while the
+# next is being denoised and a third is downloading. Only as many sermons as
+# the stages can hold are in flight at once, which keeps scratch disk use down,
+# and no more are started than today's Youtube quota can take.
+
+DOWNLOAD_WORKERS = int(os.environ.get("BACKFILL_DOWNLOADS", "2"))
+CPU_WORKERS = int(
+    os.environ.get("BACKFILL_CPU", str(max(1, (os.cpu_count() or 2) // 2)))
+)
+UPLOAD_WORKERS = int(os.environ.get("BACKFILL_UPLOADS", "2"))
+# Guessed timings below this are too likely to cut the wrong part of the stream
+MIN_CONFIDENCE = float(os.environ.get("BACKFILL_MIN_CONFIDENCE", "0.5"))
+SCRATCH = "process/backfill"
+LOCK = "process/backfill.lock"
+# Progress id for the run as a whole; each sermon reports under its own job id
+RUN = "backfill"
+TARGETS = ("youtube", "sermonAudio", "website")
+
+
+def log(msg):
+    classes.log(msg)
+
+
+# Dates to backfill, newest first, and the ones left for another day because the
+# Youtube quota won't stretch to them
+def plan(targets, limit=None):
+    index = siteindex.index()
+    dates = [date for date in reversed(index.missing()) if not jobs.active(date)]
+    if limit:
+        dates = dates[:limit]
+    if targets.get("youtube"):
+        allowed = quota.uploadsLeft()
+        return dates[:allowed], dates[allowed:]
+    return dates, []
+
+
+def download(sermon):
+    if not sermon.title:
+        raise ValueError("No bulletin details for " + sermon.date)
+    # The timing guess needs the livestream, which findVideo() may have to refresh
+    sermon.findVideo()
+    if not (sermon.start and sermon.end):
+        sermon.guessTiming()
+        if sermon.confidence < MIN_CONFIDENCE:
+            raise ValueError(f"Sermon timing guess too uncertain ({sermon.confidence})")
+    # A retry whose media all went up already only needs the website commit
+    if sermon.needsMedia():
+        sermon.fetch()
+
+
+def process(sermon):
+    if not sermon.rawVideo:
+        return
+    sermon.trimVideo()
+    if sermon.wav:
+        sermon.processAudio()
+
+
+def publish(sermon):
+    if sermon.distribute() is EnvironmentError:
+        raise EnvironmentError("Upload failed")
+
+
+class Backfill:
+    def __init__(self, dates, targets):
+        self.dates = dates
+        self.targets = targets
+        self.results = {}
+        # Job id each date's progress is reported under
+        self.jobs = {}
+        self.downloads = ThreadPoolExecutor(DOWNLOAD_WORKERS)
+        self.cpu = ThreadPoolExecutor(CPU_WORKERS)
+        self.uploads = ThreadPoolExecutor(UPLOAD_WORKERS)
+
+    # One sermon through the three stages, on its own thread from the in-flight
+    # pool; each stage waits for a slot in that stage's pool. The date is held in
+    # the job queue for the whole run, so an upload requested for it meanwhile
+    # gets this job back instead of starting another.
+    def sermon(self, date):
+        job = jobs.hold({"date": date})
+        if not job:
+            self.jobs[date] = jobs.active(date)
+            self.results[date] = "Already queued or running"
+            self.report()
+            return
+        self.jobs[date] = job
+        self.report()
+        scratch = os.path.join(SCRATCH, date)
+        os.makedirs(scratch, exist_ok=True)
+        error = None
+        try:
+            payload = {"date": date}
+            sermon = self.downloads.submit(classes.Sermon, payload, scratch).result()
+            sermon.job = job
+            sermon.youtube = self.targets["youtube"]
+            sermon.sermonAudio = self.targets["sermonAudio"]
+            sermon.website = self.targets["website"]
+            self.downloads.submit(download, sermon).result()
+            self.cpu.submit(process, sermon).result()
+            self.uploads.submit(publish, sermon).result()
+            self.results[date] = None
+        except Exception as e:
+            traceback.print_exc()
+            error = str(e) or type(e).__name__
+            self.results[date] = error
+        finally:
+            jobs.finish(job, error)
+            shutil.rmtree(scratch, ignore_errors=True)
+            self.report()
+
+    def report(self):
+        progress.update(
+            RUN, None, force=True, results=dict(self.results), jobs=dict(self.jobs)
+        )
+
+    def run(self):
+        in_flight = DOWNLOAD_WORKERS + CPU_WORKERS + UPLOAD_WORKERS
+        try:
+            with ThreadPoolExecutor(in_flight) as pool:
+                list(pool.map(self.sermon, self.dates))
+        finally:
+            for stage in (self.downloads, self.cpu, self.uploads):
+                stage.shutdown()
+        return self.results
+
+
+# Run a backfill unless one is already going in any process. Returns the
+# (dates, deferred) it took on, or None if another run holds the lock.
+def start(targets=None, limit=None, wait=False):
+    targets = {target: True for target in TARGETS} | (targets or {})
+    os.makedirs(SCRATCH, exist_ok=True)
+    lock = open(LOCK, "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None
+    try:
+        dates, deferred = plan(targets, limit)
+    except:
+        lock.close()
+        raise
+    progress.state(RUN, "running")
+    progress.update(
+        RUN,
+        None,
+        force=True,
+        started=time.time(),
+        dates=dates,
+        deferred=deferred,
+        results={},
+        jobs={},
+    )
+    log(f"Backfilling {len(dates)} sermons, {len(deferred)} left for later\n")
+
+    def run():
+        try:
+            results = Backfill(dates, targets).run()
+            failed = [date for date, error in results.items() if error]
+            progress.state(RUN, "done", ", ".join(failed) or None)
+            log(f"Backfill finished, {len(failed)} failed\n")
+        except Exception as e:
+            traceback.print_exc()
+            progress.state(RUN, "failed", str(e) or type(e).__name__)
+        finally:
+            lock.close()
+
+    if wait:
+        run()
+    else:
+        threading.Thread(target=run, daemon=True).start()
+    return dates, deferred
+
+
+# Progress of the latest backfill, with each sermon's own progress
+def status():
+    data, revision = progress.get(RUN)
+    data["sermons"] = {
+        date: progress.get(job)[0] for date, job in data.get("jobs", {}).items() if job
+    }
+    data["revision"] = revision
+    return data
@@ -0,0 +1,318 @@
+#!/usr/bin/python3
+
+#
+# Benchmarks for the hot paths in the sermon pipeline. Point them at recorded
+# data where there is some, otherwise they build synthetic input of growing size
+# so the scaling is visible.
+#
+
+import argparse
+import glob
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import timing
+
+
+def best(function, *args, repeat=5):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+# Transcript shaped like a run of services: each block of 1000 captions (3 s
+# apart) opens with "amen please be seated" and is followed by a steady stream of
+# "name amen" prayers that never qualify because the congregation was seated
+# again, which is the worst case for the window check
+def synthetic_transcript(captions, seed=0):
+    rng = random.Random(seed)
+    words = "grace faith lord word people today scripture hope love mercy".split()
+    transcript = []
+    for i in range(captions):
+        offset = i % 1000
+        if offset == 0:
+            text = "amen please be"
+        elif offset == 1:
+            text = "seated"
+        elif offset == 5:
+            text = "please be seated"
+        elif offset % 5 == 0:
+            text = "in jesus name amen"
+        else:
+            text = " ".join(rng.choice(words) for _ in range(6))
+        transcript.append({"start": i * 3.0, "text": text, "duration": 3.0})
+    return transcript
+
+
+# The scanner guessTiming used to run, kept here to compare against
+def legacy_scan(transcript):
+    events = []
+    for i in range(len(transcript) - 1):
+        current_start = timedelta(seconds=transcript[i]["start"])
+        combined_text = transcript[i]["text"] + " " + transcript[i + 1]["text"]
+        events.append((current_start, combined_text))
+    start_time = None
+    for i in range(len(events) - 1):
+        time_, text = events[i]
+        if "amen please be" in text:
+            start_time = time_
+        elif "name amen" in text and start_time:
+            if timedelta(minutes=20) <= time_ - start_time <= timedelta(minutes=40):
+                between = [txt for t, txt in events if start_time < t < time_]
+                between.pop(0)
+                if not any("please be seated" in txt for txt in between):
+                    return start_time, events[i + 1][0]
+    return start_time, None
+
+
+def bench_timing(paths, legacy):
+    if paths:
+        for path in paths:
+            with open(path) as f:
+                transcript = json.load(f)
+            guess = timing.scan(transcript)
+            seconds = best(timing.scan, transcript)
+            ms = seconds * 1000
+            print(f"{path}: {len(transcript)} captions, {ms:.2f} ms, {guess}")
+        return
+    print("captions    scan ms" + ("   legacy ms" if legacy else ""))
+    for captions in (1000, 2000, 4000, 8000, 16000, 32000):
+        transcript = synthetic_transcript(captions)
+        line = f"{captions:8d} {best(timing.scan, transcript) * 1000:10.2f}"
+        if legacy:
+            line += f" {best(legacy_scan, transcript, repeat=1) * 1000:11.2f}"
+        print(line)
+
+
+# Roughly the shape of a channel streams tab: a grid of renderers each carrying
+# a few dozen nested nodes, with the continuation at the end
+def synthetic_page(videos):
+    items = []
+    for i in range(videos):
+        run = {"text": f"Worship Service {i}", "navigationEndpoint": {"params": "x"}}
+        items.append(
+            {
+                "richItemRenderer": {
+                    "content": {
+                        "videoRenderer": {
+                            "videoId": f"id{i}",
+                            "title": {"runs": [run]},
+                            "thumbnail": {"thumbnails": [{"url": "u"}] * 4},
+                            "badges": [{"metadataBadgeRenderer": {"label": "x"}}] * 3,
+                            "menu": {"items": [{"menuServiceItemRenderer": {}}] * 5},
+                        }
+                    }
+                }
+            }
+        )
+    items.append(
+        {
+            "continuationItemRenderer": {
+                "continuationEndpoint": {
+                    "clickTrackingParams": "c",
+                    "continuationCommand": {"token": "t"},
+                }
+            }
+        }
+    )
+    grid = {"richGridRenderer": {"contents": items}}
+    return {"contents": {"tabs": [{"content": grid}]}}
+
+
+# The pager's old traversal: a list used as a queue, walked once per search
+def legacy_search(partial, search_key):
+    stack = [partial]
+    while stack:
+        current_item = stack.pop(0)
+        if isinstance(current_item, dict):
+            for key, value in current_item.items():
+                if key == search_key:
+                    yield value
+                else:
+                    stack.append(value)
+        elif isinstance(current_item, list):
+            stack.extend(current_item)
+
+
+def legacy_page(data, selector):
+    next(legacy_search(data, "continuationEndpoint"), None)
+    return list(legacy_search(data, selector))
+
+
+def load_page(path):
+    import scrapetube
+
+    with open(path) as f:
+        text = f.read()
+    if path.endswith(".html"):
+        blob = scrapetube.get_json_from_html(text, "var ytInitialData = ", 0, "};")
+        return json.loads(blob + "}")
+    return json.loads(text)
+
+
+def bench_scrape(paths, legacy):
+    import scrapetube
+
+    if paths:
+        pages = [(path, load_page(path)) for path in paths]
+    else:
+        pages = [(f"synthetic {n}", synthetic_page(n)) for n in (30, 120, 480, 1920)]
+    for name, page in pages:
+        items, _ = scrapetube.get_page(page, "videoRenderer")
+        line = f"{name}: {len(items)} items, "
+        line += f"{best(scrapetube.get_page, page, 'videoRenderer') * 1000:.2f} ms"
+        if legacy:
+            seconds = best(legacy_page, page, "videoRenderer", repeat=1)
+            line += f", legacy {seconds * 1000:.2f} ms"
+        print(line)
+
+
+# Channel page HTML around a synthetic ytInitialData, with the usual long tail
+# of scripts after it
+def synthetic_html(videos):
+    config = {
+        "INNERTUBE_CONTEXT": {"client": {"clientVersion": "2.20240101", "hl": "en"}},
+        "innertubeApiKey": "AIzaSyBench",
+    }
+    head = "<html><head>" + "<meta>" * 2000
+    config = json.dumps(config, separators=(",", ":"))
+    head += f"<script>ytcfg.set({config});</script></head><body>"
+    data = json.dumps(synthetic_page(videos), separators=(",", ":"))
+    tail = "<script>" + "var x = 1;" * 60000 + "</script></body></html>"
+    return head + f"<script>var ytInitialData = {data};</script>" + tail
+
+
+def stream_extract(html, chunk=65536):
+    import scrapetube
+
+    extractor = scrapetube.InitialDataExtractor()
+    read = 0
+    for pos in range(0, len(html), chunk):
+        read += len(html[pos : pos + chunk])
+        if extractor.feed(html[pos : pos + chunk]):
+            break
+    extractor.result()
+    return read
+
+
+def bench_initial(paths):
+    import scrapetube
+
+    if paths:
+        pages = []
+        for path in paths:
+            with open(path) as f:
+                pages.append((path, f.read()))
+    else:
+        pages = [(f"synthetic {n}", synthetic_html(n)) for n in (30, 120, 480)]
+    print(f"json backend: {scrapetube.loads.__module__}")
+    for name, html in pages:
+        legacy = best(scrapetube.parse_initial_data, html)
+        streamed = best(stream_extract, html)
+        read = stream_extract(html)
+        print(
+            f"{name}: {len(html) // 1024} KiB page, read {read // 1024} KiB, "
+            f"{streamed * 1000:.2f} ms, legacy {legacy * 1000:.2f} ms"
+        )
+
+
+# Regression corpus of historical bulletins: each PDF can sit next to a .json of
+# the details it should parse to. --fetch fills the directory from the site's
+# back catalogue and --snapshot records the current results as expected.
+BULLETIN_CORPUS = "data/bulletins"
+
+
+def fetch_bulletins(directory):
+    import siteindex
+
+    os.makedirs(directory, exist_ok=True)
+    for date, url in sorted(siteindex.index().bulletins.items()):
+        path = os.path.join(directory, date + ".pdf")
+        if os.path.exists(path):
+            continue
+        response = siteindex.session.get(url, timeout=60)
+        response.raise_for_status()
+        with open(path, "wb") as f:
+            f.write(response.content)
+        print(f"fetched {path}")
+
+
+def parse_bulletin(path):
+    import bulletinparser
+
+    with open(path, "rb") as f:
+        content = f.read()
+    try:
+        return path, bulletinparser.extract(content)
+    except ValueError as e:
+        return path, {"error": str(e)}
+
+
+def bench_bulletins(paths, workers, snapshot):
+    if not paths:
+        print(f"no bulletins, fetch some into {BULLETIN_CORPUS} with --fetch")
+        return
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(parse_bulletin, paths, chunksize=4))
+    seconds = time.perf_counter() - started
+    failed = mismatched = 0
+    for path, details in results:
+        expected_path = os.path.splitext(path)[0] + ".json"
+        if "error" in details:
+            failed += 1
+            print(f"{path}: {details['error']}")
+        if snapshot:
+            with open(expected_path, "w") as f:
+                json.dump(details, f, indent=2)
+        elif os.path.exists(expected_path):
+            with open(expected_path) as f:
+                expected = json.load(f)
+            if expected != details:
+                mismatched += 1
+                print(f"{path}: expected {expected}, got {details}")
+    print(
+        f"{len(paths)} bulletins in {seconds:.2f} s "
+        f"({len(paths) / seconds:.1f}/s with {workers} workers), "
+        f"{failed} unparsed, {mismatched} changed"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sermon pipeline hot paths")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p = sub.add_parser("timing", help="transcript scanner used by guessTiming")
+    p.add_argument("transcripts", nargs="*", help="transcript JSON files or globs")
+    p.add_argument("--legacy", action="store_true", help="also time the old scanner")
+    p = sub.add_parser("scrape", help="scrapetube page traversal")
+    p.add_argument("pages", nargs="*", help="saved ytInitialData JSON or page HTML")
+    p.add_argument("--legacy", action="store_true", help="also time the old traversal")
+    p = sub.add_parser("initial", help="initial page JSON extraction in scrapetube")
+    p.add_argument("pages", nargs="*", help="saved channel page HTML")
+    p = sub.add_parser("bulletins", help="bulletin PDF extractor over a corpus")
+    p.add_argument("pdfs", nargs="*", help=f"bulletin PDFs, default {BULLETIN_CORPUS}")
+    p.add_argument("--workers", type=int, default=os.cpu_count())
+    p.add_argument("--fetch", action="store_true", help="download the back catalogue")
+    p.add_argument("--snapshot", action="store_true", help="save results as expected")
+    args = parser.parse_args()
+    if args.bench == "timing":
+        paths = [path for pattern in args.transcripts for path in glob.glob(pattern)]
+        bench_timing(paths, args.legacy)
+    elif args.bench == "scrape":
+        paths = [path for pattern in args.pages for path in glob.glob(pattern)]
+        bench_scrape(paths, args.legacy)
+    elif args.bench == "initial":
+        bench_initial([path for pattern in args.pages for path in glob.glob(pattern)])
+    elif args.bench == "bulletins":
+        if args.fetch:
+            fetch_bulletins(BULLETIN_CORPUS)
+        patterns = args.pdfs or [os.path.join(BULLETIN_CORPUS, "*.pdf")]
+        paths = sorted(path for pattern in patterns for path in glob.glob(pattern))
+        bench_bulletins(paths, args.workers, args.snapshot)
@@ -0,0 +1,84 @@
+import re
+from io import BytesIO
+
+from pdfminer.high_level import extract_pages
+from pdfminer.layout import LAParams, LTTextContainer
+
+# Pulls the sermon title, passage and speaker off the front page of a bulletin.
+# Only the text boxes that mention one of the labels are read at first, which is
+# most of the speedup on a busy front page; if the fields aren't all there the
+# whole page is tried before giving up with a BulletinFormatError.
+
+
+class BulletinFormatError(ValueError):
+    pass
+
+
+# Bulletins are single column text with a few images; skipping text inside
+# figures and vertical text detection saves most of pdfminer's layout work
+LAYOUT = LAParams(
+    line_margin=0.5,
+    char_margin=2.0,
+    word_margin=0.1,
+    boxes_flow=0.5,
+    detect_vertical=False,
+    all_texts=False,
+)
+
+LABELS = re.compile(r"Sermon|Pastor|Text:")
+# "Sermon <title> Text: <passage>", with the passage running up to the next
+# section (usually the Bible reading), the speaker or the end of the text
+SERMON = re.compile(
+    r"Sermon\s*:?\s*(?P<title>\S.*?)\s*Text:\s*"
+    r"(?P<passage>.+?)\s*(?:Bible|Pastor|\s{2,}|$)"
+)
+# Speaker names end at the column gap, which shows up as a run of spaces
+SPEAKER = re.compile(r"Pastor\s+(?P<speaker>.+?)(?:\s{2,}|$)")
+SPACES = re.compile(r"[\r\n]+")
+TRAILING = re.compile(r"[\s.,;:|-]+$")
+
+
+# Text of each box on the first page, newlines flattened to spaces as they were
+# for the old extract_text based parser
+def boxes(content):
+    page = next(
+        extract_pages(BytesIO(content), page_numbers=[0], laparams=LAYOUT), None
+    )
+    if page is None:
+        return []
+    return [
+        SPACES.sub(" ", element.get_text())
+        for element in page
+        if isinstance(element, LTTextContainer)
+    ]
+
+
+def fields(text):
+    sermon = SERMON.search(text)
+    speaker = SPEAKER.search(text)
+    if not sermon or not speaker:
+        return None
+    found = {
+        "title": sermon.group("title").strip(),
+        "passage": TRAILING.sub("", sermon.group("passage")),
+        "speaker": TRAILING.sub("", speaker.group("speaker")),
+    }
+    # A blank field means the labels matched but the value sits somewhere else,
+    # e.g. the title in its own box, so let fromBoxes() try the whole page
+    if not all(found.values()):
+        return None
+    return found
+
+
+# Details from the text boxes of a front page, trying just the labelled boxes
+# before the whole page
+def fromBoxes(texts):
+    relevant = " ".join(text for text in texts if LABELS.search(text))
+    return fields(relevant) or fields(" ".join(texts))
+
+
+def extract(content):
+    found = fromBoxes(boxes(content))
+    if not found:
+        raise BulletinFormatError("No sermon title, passage or speaker in bulletin")
+    return found
@@ -0,0 +1,151 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bulletinparser
+import siteindex
+import store
+
+# Sermon details parsed from the weekly bulletin PDFs, cached in the shared store
+# by bulletin URL and by the PDF's content hash. A bulletin is downloaded and
+# parsed at most once per version, in memory, and refreshData pre-parses new ones
+# in the background so sermon lookups only read the cache. Cached bulletins are
+# revalidated (ETag/Last-Modified, then the content hash) once they're older than
+# REVALIDATE, so a corrected PDF put up under the same URL gets parsed again.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bulletins (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    title TEXT,
+    passage TEXT,
+    speaker TEXT,
+    parser INTEGER NOT NULL,
+    parsed REAL NOT NULL,
+    etag TEXT,
+    modified TEXT,
+    checked REAL
+);
+CREATE INDEX IF NOT EXISTS bulletins_sha256 ON bulletins (sha256);
+"""
+# Columns added after the table first shipped
+COLUMNS = {"etag": "TEXT", "modified": "TEXT", "checked": "REAL"}
+
+# Bump when parse() changes so bulletins it failed on get another try
+PARSER = 2
+REVALIDATE = int(os.environ.get("BULLETIN_REVALIDATE", str(24 * 60 * 60)))
+
+# Rows with no title are bulletins the current parser couldn't read
+CACHED = "(title IS NOT NULL OR parser = ?)"
+DETAILS = "SELECT title, passage, speaker FROM bulletins"
+BY_URL = f"""
+SELECT title, passage, speaker, sha256, etag, modified, {CACHED}
+FROM bulletins WHERE url = ?
+"""
+BY_HASH = f"{DETAILS} WHERE sha256 = ? AND {CACHED} LIMIT 1"
+SAVE = """
+INSERT OR REPLACE INTO bulletins
+    (url, sha256, title, passage, speaker, parser, parsed, etag, modified, checked)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+CHECKED = "UPDATE bulletins SET etag = ?, modified = ?, checked = ? WHERE url = ?"
+FRESH = f"SELECT url FROM bulletins WHERE {CACHED} AND checked >= ?"
+
+_preparsing = threading.Lock()
+_migrated = False
+
+
+def connect():
+    global _migrated
+    store.ensure(SCHEMA)
+    conn = store.connect()
+    if not _migrated:
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(bulletins)")}
+        for column, kind in COLUMNS.items():
+            if column not in existing:
+                try:
+                    conn.execute(f"ALTER TABLE bulletins ADD COLUMN {column} {kind}")
+                except sqlite3.OperationalError:
+                    # Another process added it first
+                    pass
+        _migrated = True
+    return conn
+
+
+def row(values):
+    if values[0] is None:
+        raise ValueError("Bulletin couldn't be parsed")
+    return dict(zip(("title", "passage", "speaker"), values))
+
+
+# Title, passage and speaker from the first page of a bulletin PDF. Raises
+# bulletinparser.BulletinFormatError (a ValueError) when they aren't there.
+def parse(content):
+    return bulletinparser.extract(content)
+
+
+# Sermon details for a bulletin, downloading and parsing it only on a cache miss.
+# Raises ValueError for bulletins the parser can't read; that is cached too, so
+# the PDF isn't parsed again until it or the parser changes. With revalidate the
+# cached copy is checked against the site first and re-parsed if it changed.
+def get(url, revalidate=False):
+    conn = connect()
+    cached = conn.execute(BY_URL, (PARSER, url)).fetchone()
+    usable = cached and cached[6]
+    if usable and not revalidate:
+        return row(cached)
+    headers = {}
+    if usable and cached[4]:
+        headers["If-None-Match"] = cached[4]
+    if usable and cached[5]:
+        headers["If-Modified-Since"] = cached[5]
+    response = siteindex.session.get(url, headers=headers, timeout=60)
+    etag = response.headers.get("ETag")
+    modified = response.headers.get("Last-Modified")
+    now = time.time()
+    if usable and response.status_code == 304:
+        conn.execute(CHECKED, (cached[4], cached[5], now, url))
+        return row(cached)
+    response.raise_for_status()
+    content = response.content
+    digest = hashlib.sha256(content).hexdigest()
+    if usable and digest == cached[3]:
+        conn.execute(CHECKED, (etag, modified, now, url))
+        return row(cached)
+    same = conn.execute(BY_HASH, (digest, PARSER)).fetchone()
+    if same:
+        values = tuple(same)
+    else:
+        try:
+            details = parse(content)
+            values = (details["title"], details["passage"], details["speaker"])
+        except Exception:
+            values = (None, None, None)
+    conn.execute(SAVE, (url, digest) + values + (PARSER, now, etag, modified, now))
+    return row(values)
+
+
+# Parse every bulletin the site lists that isn't cached yet, and revalidate the
+# cached ones that haven't been checked in REVALIDATE seconds
+def preparse(workers=4):
+    if not _preparsing.acquire(blocking=False):
+        return
+    try:
+        since = time.time() - REVALIDATE
+        fresh = {url for (url,) in connect().execute(FRESH, (PARSER, since))}
+        listed = siteindex.index().bulletins.values()
+        urls = [url for url in listed if url not in fresh]
+
+        def fetch(url):
+            try:
+                get(url, revalidate=True)
+            except Exception:
+                pass
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(fetch, urls))
+    finally:
+        _preparsing.release()
@@ -1,20 +1,21 @@
 import os
-import re
-import subprocess
+import threading
 import time
-from datetime import datetime
-from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
 
-
-import requests
-from dateutil.parser import parse
 from dotenv import load_dotenv
-from pdfminer.high_level import extract_text
-from youtube_transcript_api import YouTubeTranscriptApi
-from pydub import AudioSegment
 from yt_dlp import YoutubeDL
+from yt_dlp.utils import download_range_func
 
-import scrapetube
+import bulletins
+import ledger
+import livestreams
+import media
+import progress
+import quota
+import siteindex
+import timing
+import transcripts
 import upload
 
 if not os.path.exists("/.dockerenv"):
@@ -28,6 +29,13 @@ def log(msg):
         f.write(msg)
 
 
+# Size of a file in bytes for progress reports, None if it doesn't exist
+def fileSize(path):
+    if path and os.path.exists(str(path)):
+        return os.path.getsize(path)
+    return None
+
+
 class Sermon:
 
     # Attributes:
@@ -38,14 +46,20 @@ class Sermon:
     # series: series name (optional)
     # start: livestream timestamp when sermon starts. Format HH:MM:SS (optional)
     # end: livestream timestamp when sermon ends. Format HH:MM:SS (optional)
+    # confidence: how sure guessTiming is about start and end, 0 to 1
     # videoId: Youtube ID for livestream
+    # workdir: scratch directory for downloads and intermediate files
+    # job: upload job id to report progress to (optional)
     # audio: current location of audio file
+    # wav: mono WAV split off the video, waiting for noise reduction
     # video: current location of video file
     # filename: final pretty filename, ends in mp. Tack on 3 or 4
 
     # Constructor for initializing a Sermon object
-    def __init__(self, payload):
+    def __init__(self, payload, workdir="process"):
         self.date = payload["date"]
+        # Scratch directory for this sermon's downloads and intermediate files
+        self.workdir = workdir
         try:
             self.title = payload["title"]
             self.speaker = payload["speaker"]
@@ -72,184 +86,68 @@ class Sermon:
             pass
         self.audio = None
         self.video = None
+        self.wav = None
+        self.rawVideo = None
+        self.sectioned = False
+        self.confidence = None
+        # Job id progress is reported against, if this sermon runs as a queued job
+        self.job = None
+        # Upload results by target, and SHA-256 of the files uploaded
+        self.results = {}
+        self.hashes = {}
         # Create sermon if no title or videoId is provided
         if not self.title or not self.videoId:
             self.make()
 
     # Method to generate missing sermon information
     def make(self):
-        pdf_url = None
-        # Request bulletin data
-        response = requests.get(
-            "https://coventrypca.church/assets/data/bulletins/index.json"
-        )
-        json = response.json()
-        bulletins = json["data"]["bulletins"]["edges"]
-        # Grab bulletin for specific date:
-        for bulletin in bulletins:
-            link = bulletin["node"]["url"]
-            if self.date in link:
-                pdf_url = link
-                break
+        # Grab bulletin for specific date from the cached site index:
+        pdf_url = siteindex.index().bulletin(self.date)
         if not pdf_url:
-            num = 2
-            while not pdf_url:
-                response = requests.get(
-                    f"https://coventrypca.church/assets/data/bulletins/{num}/index.json"
-                )
-                if response.status_code == 404:
-                    log("Can't find bulletin online!\n")
-                    return
-                json = response.json()
-                bulletins = json["data"]["bulletins"]["edges"]
-                # Grab bulletin for specific date:
-                for bulletin in bulletins:
-                    link = bulletin["node"]["url"]
-                    if self.date in link:
-                        pdf_url = link
-                        break
-                num += 1
-        # Download selected bulletin locally:
-        pdf = requests.get(pdf_url)
-        pdf_name = str(pdf_url[-23:])
-        open("process/" + pdf_name, "wb").write(pdf.content)
-        pdf_path = "process/" + pdf_name
-        # Grab needed data from bulletin:
-        text = extract_text(pdf_path, page_numbers=[0])
-        text = text.replace("\n", " ").replace("\r", "")
-        splitted = re.split("Sermon", text)
-        final = re.split("Bible", splitted[1])
-        thingie = re.split("Text: ", final[0])
-        title = str(thingie[0]).strip()
-        passage = thingie[1][:-2]
-        speaker_test = (re.split("Pastor ", text))[1]
-        speaker = (re.split("  ", speaker_test))[0]
-        # Delete bulletin and assign class attributes
-        os.remove(pdf_path)
+            log("Can't find bulletin online!\n")
+            return
+        # Grab needed data from bulletin (cached after the first parse):
+        details = bulletins.get(pdf_url)
         # Find livestream if possible
-        channel_id = os.environ["CHANNEL_ID"]
-        videos = scrapetube.get_channel(channel_id, "", 52, 1, "newest", "streams")
-        date_obj = datetime.strptime(self.date, "%Y-%m-%d")
-        M_D_YY = " " + date_obj.strftime("%-m/%-d/%y")
-        self.videoId = None
-        for video in videos:
-            if M_D_YY in video["title"]["runs"][0]["text"]:
-                self.videoId = video["videoId"]
-        self.title = title
-        self.text = passage
-        self.speaker = speaker
+        self.videoId = livestreams.find(self.date)
+        self.title = details["title"]
+        self.text = details["passage"]
+        self.speaker = details["speaker"]
 
     # MARK: Info methods
     # Method to check if the sermon has already been uploaded
     def isUploaded(self):
         try:
-            sermons = []
-            response = requests.get(
-                "https://coventrypca.church/assets/data/sermons/all/index.json"
-            )
-            json = response.json()
-            sermons_raw = json["data"]["sermons"]["edges"]
-            # Grab bulletin for specific date:
-            for sermon in sermons_raw:
-                date = sermon["node"]["date"]
-                date_int = datetime.strftime(parse(date), "%Y-%m-%d")
-                sermons.append(date_int)
-            num = 2
-            while response.status_code != 404:
-                response = requests.get(
-                    f"https://coventrypca.church/assets/data/sermons/all/{num}/index.json"
-                )
-                json = response.json()
-                sermons_raw = json["data"]["bulletins"]["edges"]
-                # Grab bulletin for specific date:
-                for sermon in sermons_raw:
-                    date = sermon["node"]["date"]
-                    date_int = datetime.strftime(parse(date), "%Y-%m-%d")
-                    sermons.append(date_int)
-                num += 1
+            uploaded = siteindex.index().isUploaded(self.date)
         except:
-            sermons = []
-        if self.date in sermons:
-            self.uploaded = True
-            return True
-        else:
-            self.uploaded = False
-            return False
+            uploaded = False
+        self.uploaded = uploaded
+        return uploaded
 
     # Method to estimate the start and end time of the sermon from the transcript
     def guessTiming(self):
-        if not self.videoId:
-            self.start = "0:20:00"
-            self.end = "0:50:00"
-            return
-        try:
-            transcript = YouTubeTranscriptApi.get_transcript(self.videoId)
-        except Exception:
-            self.start = "0:20:00"
-            self.end = "0:50:00"
-            return
-        if not transcript:
-            self.start = "0:20:00"
-            self.end = "0:50:00"
-            return
-        events = []
-        for i in range(len(transcript) - 1):
-            current_start = timedelta(seconds=transcript[i]["start"])
-            combined_text = transcript[i]["text"] + " " + transcript[i + 1]["text"]
-            events.append((current_start, combined_text))
-        for i in range(len(events) - 1):
-            time, text = events[i]
-            if "amen please be" in text:
-                start_time = time
-            # elif "please be seated" in text:
-            #     start_time = time
-            elif "name amen" in text and start_time:
-                if time - start_time >= timedelta(
-                    minutes=20
-                ) and time - start_time <= timedelta(minutes=40):
-                    intermediate_texts = [
-                        txt for t, txt in events if start_time < t < time
-                    ]
-                    intermediate_texts.pop(0)
-                    if not any("please be seated" in txt for txt in intermediate_texts):
-                        end_time = events[i + 1][0]
-                        break
-            # elif "let's stand" in text and start_time:
-            #     if time - start_time >= timedelta(minutes=20) and time - start_time <= timedelta(minutes=40):
-            #         intermediate_texts = [txt for t, txt in events if start_time < t < time]
-            #         intermediate_texts.pop(0)
-            #         if not any("please be seated" in txt for txt in intermediate_texts):
-            #             end_time = events[i - 1][0]
-            #             break
-            elif "closing hymn" in text and start_time:
-                if time - start_time >= timedelta(
-                    minutes=20
-                ) and time - start_time <= timedelta(minutes=45):
-                    intermediate_texts = [
-                        txt for t, txt in events if start_time < t < time
-                    ]
-                    intermediate_texts.pop(0)
-                    if not any("please be seated" in txt for txt in intermediate_texts):
-                        end_time = events[i - 2][0]
-                        break
-        if start_time and end_time:
-            self.start = start_time
-            self.end = end_time
-            return
-        elif start_time:
-            self.start = start_time
-            self.end = "0:50:00"
-            return
-        else:
-            self.start = "0:20:00"
-            self.end = "0:50:00"
-            return
+        transcript = None
+        if self.videoId:
+            try:
+                transcript = transcripts.get(self.videoId)
+            except Exception:
+                transcript = None
+        guess = timing.scan(transcript)
+        self.start = guess.start
+        self.end = guess.end
+        self.confidence = guess.confidence
 
     # MARK: Action methods
-    # Method to download the sermon video
+    # Method to download the sermon video and cut it down to the sermon
     def download(self):
+        self.fetch()
+        self.trimVideo()
+
+    # Method to download the livestream, or just the sermon section of it
+    def fetch(self):
         self.filename = (
-            "process/"
+            self.workdir
+            + "/"
             + self.date.replace("-", ".")
             + ".A "
             + str(self.title).replace("/", "-")
@@ -257,140 +155,280 @@ class Sermon:
             + self.speaker
             + ".mp"
         )
+        self.findVideo()
+        video = "https://www.youtube.com/watch?v=" + str(self.videoId)
+        # Only fetch the sermon itself when we already know where it is
+        self.sectioned = False
+        if self.start and self.end:
+            section = (media.seconds(self.start), media.seconds(self.end))
+            try:
+                self.fetchVideo(video, section)
+                self.sectioned = os.path.exists(str(self.rawVideo))
+            except Exception:
+                self.sectioned = False
+            if not self.sectioned:
+                log("❌\nSection download failed, falling back to full livestream\n")
+        if not self.sectioned:
+            self.fetchVideo(video)
+
+    # Method to look up the livestream if the payload didn't name one. We're on an
+    # upload worker here, so it's fine to wait for the channel.
+    def findVideo(self):
         if not self.videoId:
-            channel_id = os.environ["CHANNEL_ID"]
-            videos = scrapetube.get_channel(channel_id, "", 20, 1, "newest", "streams")
-            date_obj = datetime.strptime(self.date, "%Y-%m-%d")
-            M_D_YY = " " + date_obj.strftime("%-m/%-d/%y")
-            for video in videos:
-                if M_D_YY in video["title"]["runs"][0]["text"]:
-                    self.videoId = video["videoId"]
-        # Download with yt_dlp
+            self.videoId = livestreams.find(self.date)
+            if not self.videoId:
+                livestreams.refresh()
+                self.videoId = livestreams.find(self.date)
+
+    # Method to download the livestream with yt_dlp, optionally only the
+    # (start, end) section in seconds
+    def fetchVideo(self, video, section=None):
         ydl_opts = {
             "format": "bv*[ext=mp4]+ba[ext=m4a]/b[ext=mp4]",
-            "outtmpl": "process/%(title)s" + ".mp4",
+            "outtmpl": self.workdir + "/%(title)s" + ".mp4",
             "quiet": True,
+            "progress_hooks": [self.downloadProgress],
         }
-        video = "https://www.youtube.com/watch?v=" + str(self.videoId)
+        if section:
+            ydl_opts["download_ranges"] = download_range_func(None, [section])
         with YoutubeDL(ydl_opts) as ydl:
             log("Downloading livestream...")
+            progress.start(self.job, "download", videoId=self.videoId, section=section)
             info_dict = ydl.extract_info(video, download=True)
-            self.rawVideo = (
-                "process/" + (info_dict.get("title", None)).replace("/", "_") + ".mp4"
+            downloads = info_dict.get("requested_downloads") or [{}]
+            self.rawVideo = downloads[0].get("filepath") or (
+                self.workdir
+                + "/"
+                + (info_dict.get("title", None)).replace("/", "_")
+                + ".mp4"
             )
             self.videoLength = info_dict.get("duration")
+            progress.finish(self.job, "download", bytes=fileSize(self.rawVideo))
             log("✅\n")
-        if self.start and self.end:
-            self.trimVideo()
-        else:
-            self.video = self.rawVideo
 
-    # Method to trim the downloaded video to the sermon portion
+    # Method to report yt_dlp download progress to the job status
+    def downloadProgress(self, status):
+        if status["status"] != "downloading":
+            return
+        done = status.get("downloaded_bytes") or 0
+        total = status.get("total_bytes") or status.get("total_bytes_estimate")
+        fields = {"bytes": done, "total": total}
+        if total:
+            fields["percent"] = round(100 * done / total, 1)
+        progress.update(self.job, "download", **fields)
+
+    # Method to trim the downloaded video to the sermon portion and pull out its
+    # audio for noise reduction, in a single ffmpeg pass over the download
     def trimVideo(self):
         log("Trimming livestream...")
+        progress.start(self.job, "trim")
+        # A section download is already just the sermon
+        trim = bool(self.start and self.end) and not self.sectioned
+        wav = None
+        if self.sermonAudio or self.website:
+            wav = self.workdir + "/reduce.wav"
         try:
-            os.rename(self.rawVideo, "process/video.mp4")
-            self.rawVideo = "process/video.mp4"
-            start = time.strftime("%H:%M:%S", time.gmtime(self.start))
-            end = time.strftime("%H:%M:%S", time.gmtime(self.end))
-            subprocess.run(
-                [
-                    "ffmpeg",
-                    "-y",
-                    "-i",
+            if not trim and not wav:
+                self.video = self.rawVideo
+            else:
+                video = self.filename + "4" if trim else None
+                media.split(
                     self.rawVideo,
-                    "-c",
-                    "copy",
-                    "-ss",
-                    start,
-                    "-to",
-                    end,
-                    (self.filename + "4"),
-                ],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-            )
-            os.remove(self.rawVideo)
-            self.video = self.filename + "4"
+                    video=video,
+                    wav=wav,
+                    start=self.start if trim else None,
+                    end=self.end if trim else None,
+                )
+                if trim:
+                    os.remove(self.rawVideo)
+                    self.video = video
+                else:
+                    self.video = self.rawVideo
+                self.wav = wav
+            progress.finish(self.job, "trim", bytes=fileSize(self.video))
             log("✅\n")
         except:
+            progress.finish(self.job, "trim", ok=False)
             log("❌\n")
 
     # Method to process the sermon audio with noise reduction
     def processAudio(self):
-        # Run noisereduction on provided file:
-        if not self.audio:
+        # Run noisereduction on the WAV split off the video:
+        if not self.wav:
             return ValueError
         log("Applying noise reduction...")
+        progress.start(self.job, "denoise")
         try:
-            sound = AudioSegment.from_mp3(self.audio)
-            sound = sound.set_channels(1)
-            original = self.audio
-            sound.export("process/reduce.wav", format="wav")
-            subprocess.run(
-                [
-                    "data/noisereducer",
-                    "-i",
-                    "process/reduce.wav",
-                    "-o",
-                    "process/denoised.wav",
-                    "-p",
-                    "data/noise.wav",
-                    "--noiseGain",
-                    "12",
-                    "--sensitivity",
-                    "6",
-                    "--smoothing",
-                    "3",
-                ],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-            )
-            new_sound = AudioSegment.from_wav("process/denoised.wav")
+            denoised = self.workdir + "/denoised.wav"
+            media.denoise(self.wav, denoised)
             self.audio = self.filename + "3"
-            new_sound.export(self.audio, format="mp3", codec="libmp3lame")
-            os.remove("process/denoised.wav")
-            os.remove("process/reduce.wav")
-            os.remove(original)
+            media.encodeMp3(denoised, self.audio)
+            os.remove(denoised)
+            os.remove(self.wav)
+            self.wav = None
+            progress.finish(self.job, "denoise", bytes=fileSize(self.audio))
             log("✅\n")
         except:
+            progress.finish(self.job, "denoise", ok=False)
             log("❌\n")
 
-    # Method to convert video to audio
-    def videoToAudio(self):
-        log("Converting video to audio...")
-        try:
-            subprocess.run(
-                ["ffmpeg", "-y", "-i", str(self.video), "process/audio.mp3"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-            )
-            self.audio = "process/audio.mp3"
-            log("✅\n")
-        except:
-            log("❌\n")
+    # Method to build an upload progress callback for a target; it gets the bytes
+    # sent since the last call, possibly from several threads at once
+    def transferProgress(self, target, total):
+        lock = threading.Lock()
+        sent = [0]
+
+        def callback(count):
+            with lock:
+                sent[0] += count
+                done = sent[0]
+            fields = {"bytes": done, "total": total}
+            if total:
+                fields["percent"] = round(100 * done / total, 1)
+            progress.update(self.job, target, **fields)
+
+        return callback
+
+    # Method to get the ledger key for what this sermon's uploads are made from.
+    # Targets built from other targets' results pass those in as extra inputs.
+    def recipe(self, **extra):
+        return ledger.recipe(
+            videoId=self.videoId,
+            start=self.start,
+            end=self.end,
+            title=self.title,
+            speaker=self.speaker,
+            text=self.text,
+            series=self.series,
+            **extra,
+        )
+
+    # Method to check whether any enabled media upload still has to happen
+    def needsMedia(self):
+        targets = []
+        if self.youtube:
+            targets.append("youtube")
+        if self.sermonAudio:
+            targets.append("sermonaudio")
+        if self.website:
+            targets.append("wasabi")
+        recipe = self.recipe()
+        return any(ledger.find(self.date, t, recipe) is None for t in targets)
+
+    # Method to reuse an earlier successful upload of the same sermon to a target,
+    # returns its result or None if it has to be uploaded
+    def reuse(self, target, artifact=None, inputs=None):
+        digest = None
+        if artifact and os.path.exists(str(artifact)):
+            digest = self.hashes.get(artifact) or ledger.fileHash(artifact)
+            self.hashes[artifact] = digest
+        recipe = self.recipe(**(inputs or {}))
+        previous = ledger.find(self.date, target, recipe, digest)
+        if previous is None:
+            return None
+        self.results[target] = {"result": previous, "seconds": 0, "reused": True}
+        progress.finish(self.job, target, result=previous, reused=True)
+        log(f"Already uploaded to {target}, reusing it ✅\n")
+        return previous
+
+    # Method to run one upload target, recording its result and timing. Targets
+    # that already succeeded for the same sermon are skipped.
+    def publish(self, target, function, *args, artifact=None, inputs=None):
+        previous = self.reuse(target, artifact, inputs)
+        if previous is not None:
+            return previous
+        return self.send(target, function, *args, artifact=artifact, inputs=inputs)
+
+    # Method to run one upload target without checking for an earlier upload,
+    # for callers that already did
+    def send(self, target, function, *args, artifact=None, inputs=None):
+        progress.start(self.job, target)
+        started = time.time()
+        result = function(*args)
+        self.results[target] = {
+            "result": result,
+            "seconds": round(time.time() - started, 3),
+        }
+        progress.finish(self.job, target, ok=bool(result), result=result)
+        if result:
+            digest = self.hashes.get(artifact) if artifact else None
+            recipe = self.recipe(**(inputs or {}))
+            ledger.record(self.date, target, recipe, digest, result)
+        return result
+
+    # Method to publish the sermon audio to a target. When audio processing failed
+    # there is no file, and SermonAudio would otherwise create a sermon with no
+    # audio, so the target is skipped unless an earlier upload can be reused.
+    def publishAudio(self, target, function, *args):
+        previous = self.reuse(target, self.audio)
+        if previous is not None:
+            return previous
+        if not os.path.exists(str(self.audio)):
+            progress.skip(self.job, target, "no audio file")
+            log(f"No audio file found, will not upload to {target}.\n")
+            return None
+        return self.send(target, function, *args, artifact=self.audio)
+
+    # Method to upload the video to Youtube, returns the video link
+    def uploadYoutube(self):
+        if not self.youtube:
+            progress.skip(self.job, "youtube")
+            return None
+        previous = self.reuse("youtube", self.video)
+        if previous is not None:
+            return previous
+        if not os.path.exists(str(self.video)):
+            progress.skip(self.job, "youtube", "no video file")
+            log("No matching video file found, will not upload to Youtube.\n")
+            return None
+        if not quota.spend():
+            progress.skip(self.job, "youtube", "daily quota used")
+            log("Youtube upload quota used up for today, skipping Youtube.\n")
+            return None
+        auth = upload.getAuthenticatedService()
+        return self.send(
+            "youtube",
+            upload.youtube,
+            auth,
+            self.video,
+            self.title,
+            self.text,
+            self.speaker,
+            self.date,
+            self.transferProgress("youtube", fileSize(self.video)),
+            # reuse() already hashed the video
+            self.hashes.get(self.video),
+            artifact=self.video,
+        )
 
-    # Method to upload the sermon to various platforms
+    # Method to download the sermon and upload it to various platforms. A retry
+    # of an upload whose media all went up already goes straight to the website.
     def upload(self):
-        self.download()
-        if self.sermonAudio or self.website:
-            self.videoToAudio()
-            self.processAudio()
-        # Youtube Upload:
-        if os.path.exists(str(self.video)):
-            if self.youtube:
-                auth = upload.getAuthenticatedService()
-                video = upload.youtube(
-                    auth, self.video, self.title, self.text, self.speaker, self.date
-                )
-            else:
-                video = None
+        self.findVideo()
+        if self.needsMedia():
+            self.download()
         else:
-            video = None
-            log("No matching video file found, will not upload to Youtube.\n")
-        try:
+            log("Sermon media already uploaded, skipping download\n")
+        return self.distribute()
+
+    # Method to upload the downloaded sermon. The independent uploads run in
+    # parallel: Youtube starts as soon as the video is ready, the audio is
+    # processed meanwhile (unless that already happened), then SermonAudio and
+    # Wasabi go up together and the website commit waits only for the Wasabi URL
+    # and Youtube link it needs.
+    def distribute(self):
+        self.results = {}
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            youtube = pool.submit(self.uploadYoutube)
+            if self.wav:
+                self.processAudio()
+            sermonaudio = None
+            wasabi = None
             if self.sermonAudio:
-                upload.sermonaudio(
+                sermonaudio = pool.submit(
+                    self.publishAudio,
+                    "sermonaudio",
+                    upload.sermonaudio,
                     self.audio,
                     self.title,
                     self.series,
@@ -398,21 +436,64 @@ class Sermon:
                     self.speaker,
                     self.date,
                 )
+            else:
+                progress.skip(self.job, "sermonaudio")
             if self.website:
-                audio = upload.wasabi(self.audio)
-                upload.git(
-                    self.title,
-                    self.text,
-                    self.speaker,
-                    self.series,
-                    self.date,
-                    audio,
-                    video,
+                wasabi = pool.submit(
+                    self.publishAudio,
+                    "wasabi",
+                    upload.wasabi,
+                    self.audio,
+                    self.transferProgress("wasabi", fileSize(self.audio)),
                 )
-            os.remove(str(self.video))
-            os.remove(str(self.audio))
-            log("Upload successful!\n")
-            return
-        except:
-            log("Upload failed! Stopping\n")
+            else:
+                progress.skip(self.job, "wasabi")
+                progress.skip(self.job, "git")
+            try:
+                # The website only needs the Youtube link and the Wasabi URL, so
+                # it doesn't wait for SermonAudio
+                video = youtube.result()
+                if wasabi:
+                    audio = wasabi.result()
+                    if audio:
+                        self.publish(
+                            "git",
+                            upload.git,
+                            self.title,
+                            self.text,
+                            self.speaker,
+                            self.series,
+                            self.date,
+                            audio,
+                            video,
+                            # The markdown links both, so a retry that adds the
+                            # Youtube link commits the page again
+                            inputs={"audio": audio, "video": video},
+                        )
+                    else:
+                        progress.skip(self.job, "git", "no audio URL")
+                if sermonaudio:
+                    sermonaudio.result()
+            except:
+                log("Upload failed! Stopping\n")
+                return EnvironmentError
+        # The upload helpers report failure by returning nothing, so check every
+        # target that was asked for
+        enabled = {
+            "youtube": self.youtube,
+            "sermonaudio": self.sermonAudio,
+            "wasabi": self.website,
+            "git": self.website,
+        }
+        failed = [
+            target
+            for target, wanted in enabled.items()
+            if wanted and not self.results.get(target, {}).get("result")
+        ]
+        if failed:
+            log("Upload failed for " + ", ".join(failed) + "!\n")
             return EnvironmentError
+        for path in (self.video, self.audio):
+            if path and os.path.exists(path):
+                os.remove(path)
+        log("Upload successful!\n")
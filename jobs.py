@@ -0,0 +1,267 @@
+import json
+import os
+import shutil
+import threading
+import time
+import traceback
+import uuid
+
+import classes
+import progress
+import store
+
+# Durable upload queue. Jobs live in the shared SQLite store so they survive a
+# restart and every gunicorn worker sees the same queue. Each worker process runs
+# a few threads that claim queued jobs, but a job is only claimed while fewer than
+# MAX_RUNNING are running across all processes, so the total stays bounded.
+
+MAX_RUNNING = int(os.environ.get("UPLOAD_WORKERS", "2"))
+SCRATCH = "process/jobs"
+POLL = 5
+# A running job whose heartbeat is older than this belonged to a dead process
+STALE = 120
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created);
+DROP INDEX IF EXISTS jobs_active_date;
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_dates ON jobs (date)
+    WHERE state IN ('queued', 'running', 'held');
+"""
+
+ACTIVE = """
+SELECT id FROM jobs WHERE date = ? AND state IN ('queued', 'running', 'held')
+"""
+INSERT = """
+INSERT INTO jobs (id, date, payload, state, created) VALUES (?, ?, ?, 'queued', ?)
+"""
+HOLD = """
+INSERT INTO jobs (id, date, payload, state, created, started, heartbeat)
+VALUES (?, ?, ?, 'held', ?, ?, ?)
+"""
+RUNNING = "SELECT COUNT(*) FROM jobs WHERE state = 'running'"
+NEXT = "SELECT id, payload FROM jobs WHERE state = 'queued' ORDER BY created LIMIT 1"
+CLAIM = "UPDATE jobs SET state = 'running', started = ?, heartbeat = ? WHERE id = ?"
+FINISH = "UPDATE jobs SET state = ?, error = ?, finished = ? WHERE id = ?"
+BEAT = """
+UPDATE jobs SET heartbeat = ? WHERE id = ? AND state IN ('running', 'held')
+"""
+REQUEUE = "UPDATE jobs SET state = 'queued' WHERE state = 'running' AND heartbeat < ?"
+# A held job's work lived in the process that held it, so there's nothing to hand on
+ABANDON = """
+UPDATE jobs SET state = 'failed', error = 'Abandoned', finished = ?
+WHERE state = 'held' AND heartbeat < ?
+"""
+GET = "SELECT id, date, state, error, created, started, finished FROM jobs WHERE id = ?"
+
+_wake = threading.Event()
+_running = set()
+_running_lock = threading.Lock()
+_started = False
+_beating = False
+_beating_lock = threading.Lock()
+
+
+def connect():
+    store.ensure(SCHEMA)
+    return store.connect()
+
+
+# Queue a sermon upload. Returns (job id, True) for a new job, or the id of the job
+# already queued or running for that date and False.
+def enqueue(payload):
+    payload = {k: v for k, v in payload.items() if k != "API_Key"}
+    conn = connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        existing = conn.execute(ACTIVE, (payload["date"],)).fetchone()
+        if existing:
+            conn.execute("COMMIT")
+            return existing[0], False
+        job_id = uuid.uuid4().hex
+        row = (job_id, payload["date"], json.dumps(payload), time.time())
+        conn.execute(INSERT, row)
+        conn.execute("COMMIT")
+    except:
+        conn.execute("ROLLBACK")
+        raise
+    progress.state(job_id, "queued")
+    _wake.set()
+    return job_id, True
+
+
+# Id of the job queued, running or held for a date, if there is one
+def active(date):
+    row = connect().execute(ACTIVE, (date,)).fetchone()
+    return row[0] if row else None
+
+
+# Job record with its progress. Pass since (a revision from an earlier call) and
+# wait to long-poll until something changes.
+def get(job_id, since=None, wait=0):
+    row = connect().execute(GET, (job_id,)).fetchone()
+    if not row:
+        return None
+    keys = ("id", "date", "state", "error", "created", "started", "finished")
+    job = dict(zip(keys, row))
+    active = ("queued", "running", "held")
+    if since is not None and wait and job["state"] in active:
+        data, revision = progress.wait(job_id, since, wait)
+        job = dict(zip(keys, connect().execute(GET, (job_id,)).fetchone()))
+    else:
+        data, revision = progress.get(job_id)
+    job["progress"] = data
+    job["revision"] = revision
+    return job
+
+
+def workdir(job_id):
+    return os.path.join(SCRATCH, job_id)
+
+
+# Take the oldest queued job if the global limit allows another one to run
+def claim():
+    conn = connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute(RUNNING).fetchone()[0] >= MAX_RUNNING:
+            conn.execute("COMMIT")
+            return None
+        row = conn.execute(NEXT).fetchone()
+        if row:
+            now = time.time()
+            conn.execute(CLAIM, (now, now, row[0]))
+        conn.execute("COMMIT")
+    except:
+        conn.execute("ROLLBACK")
+        raise
+    if not row:
+        return None
+    progress.state(row[0], "running")
+    return row[0], json.loads(row[1])
+
+
+# Claim a date for an upload run outside the queue, such as a backfill, so a
+# queued upload for the same date can't run alongside it. Held jobs don't take a
+# worker slot, since the caller bounds its own work. Returns the job id, or None
+# if the date is already queued, running or held. Call finish() when the upload
+# is over.
+def hold(payload):
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    row = (job_id, payload["date"], json.dumps(payload), now, now, now)
+    conn = connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute(ACTIVE, (payload["date"],)).fetchone():
+            conn.execute("COMMIT")
+            return None
+        conn.execute(HOLD, row)
+        conn.execute("COMMIT")
+    except:
+        conn.execute("ROLLBACK")
+        raise
+    with _running_lock:
+        _running.add(job_id)
+    # Without heartbeats the job would look abandoned
+    beat()
+    progress.state(job_id, "running")
+    return job_id
+
+
+def finish(job_id, error=None):
+    state = "failed" if error else "done"
+    connect().execute(FINISH, (state, error, time.time(), job_id))
+    with _running_lock:
+        _running.discard(job_id)
+    progress.state(job_id, state, error)
+    # A slot just opened up for whichever worker is waiting
+    _wake.set()
+
+
+def run(job_id, payload):
+    scratch = workdir(job_id)
+    os.makedirs(scratch, exist_ok=True)
+    try:
+        sermon = classes.Sermon(payload, workdir=scratch)
+        sermon.job = job_id
+        classes.log("Uploading sermon for " + payload["date"] + ":\n")
+        if sermon.upload() is EnvironmentError:
+            raise EnvironmentError("Upload failed")
+        finish(job_id)
+    except Exception as e:
+        traceback.print_exc()
+        finish(job_id, str(e) or type(e).__name__)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def worker():
+    while True:
+        try:
+            job = claim()
+        except Exception:
+            traceback.print_exc()
+            job = None
+        if not job:
+            _wake.wait(POLL)
+            _wake.clear()
+            continue
+        with _running_lock:
+            _running.add(job[0])
+        try:
+            run(*job)
+        finally:
+            with _running_lock:
+                _running.discard(job[0])
+
+
+# Keep this process's running jobs alive and hand back ones orphaned by a
+# crashed or restarted process
+def heartbeat():
+    while True:
+        try:
+            conn = connect()
+            now = time.time()
+            with _running_lock:
+                running = list(_running)
+            for job_id in running:
+                conn.execute(BEAT, (now, job_id))
+            if conn.execute(REQUEUE, (now - STALE,)).rowcount:
+                _wake.set()
+            conn.execute(ABANDON, (now, now - STALE))
+        except Exception:
+            traceback.print_exc()
+        time.sleep(STALE / 4)
+
+
+# Start the heartbeat thread for this process. Safe to call more than once.
+def beat():
+    global _beating
+    with _beating_lock:
+        if _beating:
+            return
+        _beating = True
+    threading.Thread(target=heartbeat, daemon=True).start()
+
+
+# Start the worker pool for this process. Safe to call more than once.
+def start():
+    global _started
+    if _started:
+        return
+    _started = True
+    os.makedirs(SCRATCH, exist_ok=True)
+    beat()
+    for _ in range(MAX_RUNNING):
+        threading.Thread(target=worker, daemon=True).start()
@@ -0,0 +1,80 @@
+import hashlib
+import json
+import time
+
+import store
+
+# What has already gone up where. Every successful upload is recorded against the
+# sermon date, the target and two content keys: the recipe (a hash of the inputs
+# that decide what gets uploaded: the livestream, the cut and the sermon details)
+# and the SHA-256 of the artifact file itself. A retried upload looks its
+# targets up here first and reuses the recorded video link, SermonAudio id or
+# Wasabi URL, so it carries on from the first target that didn't succeed.
+# Targets that publish the sermon details (Youtube, SermonAudio, the website) only
+# match on the recipe, so edited details go up again; a matching artifact is
+# enough only for targets that store the file alone.
+
+CONTENT_TARGETS = {"wasabi"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ledger (
+    date TEXT NOT NULL,
+    target TEXT NOT NULL,
+    recipe TEXT NOT NULL,
+    artifact TEXT,
+    result TEXT NOT NULL,
+    recorded REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ledger_recipe ON ledger (date, target, recipe);
+CREATE INDEX IF NOT EXISTS ledger_artifact ON ledger (date, target, artifact);
+"""
+
+FIND = """
+SELECT result FROM ledger WHERE date = ? AND target = ? AND recipe = ?
+ORDER BY recorded DESC LIMIT 1
+"""
+FIND_CONTENT = """
+SELECT result FROM ledger
+WHERE date = ? AND target = ? AND (recipe = ? OR artifact = ?)
+ORDER BY recorded DESC LIMIT 1
+"""
+RECORD = """
+INSERT INTO ledger (date, target, recipe, artifact, result, recorded)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+CHUNK = 1024 * 1024
+
+
+def connect():
+    store.ensure(SCHEMA)
+    return store.connect()
+
+
+def recipe(**inputs):
+    blob = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def fileHash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Recorded result of an earlier upload of the same recipe, or for content targets
+# the same artifact, or None
+def find(date, target, recipe, artifact=None):
+    if target in CONTENT_TARGETS:
+        cursor = connect().execute(FIND_CONTENT, (date, target, recipe, artifact))
+    else:
+        cursor = connect().execute(FIND, (date, target, recipe))
+    row = cursor.fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def record(date, target, recipe, artifact, result):
+    row = (date, target, recipe, artifact, json.dumps(result), time.time())
+    connect().execute(RECORD, row)
@@ -0,0 +1,115 @@
+import os
+import re
+import threading
+import time
+from datetime import date as Date
+
+import scrapetube
+import store
+
+# Persistent index of the channel's livestreams by service date. The channel is
+# only scraped by refresh(), which walks newest first and stops at the first
+# video it already knows, so after the first run a refresh is usually a single
+# page. Lookups only ever read the index.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS livestreams (
+    video_id TEXT PRIMARY KEY,
+    date TEXT,
+    title TEXT NOT NULL,
+    seq INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS livestreams_date ON livestreams (date, seq);
+"""
+
+KNOWN = "SELECT 1 FROM livestreams WHERE video_id = ?"
+LAST_SEQ = "SELECT COALESCE(MAX(seq), 0) FROM livestreams"
+INSERT = """
+INSERT OR IGNORE INTO livestreams (video_id, date, title, seq) VALUES (?, ?, ?, ?)
+"""
+# The same date can have more than one stream; the first one posted is the service
+FIND = "SELECT video_id FROM livestreams WHERE date = ? ORDER BY seq LIMIT 1"
+RECENT = "SELECT video_id FROM livestreams ORDER BY seq DESC LIMIT ?"
+
+# How far back the very first refresh goes
+FIRST_LIMIT = 300
+# Background refreshes triggered by lookups are at most this frequent
+MIN_INTERVAL = 60
+
+# Service date in stream titles, e.g. "Morning Worship 11/5/23"
+TITLE_DATE = re.compile(r"(?<!\d)(\d{1,2})/(\d{1,2})/(\d{2})(?!\d)")
+
+_lock = threading.Lock()
+_last_refresh = 0
+
+
+def connect():
+    store.ensure(SCHEMA)
+    return store.connect()
+
+
+# ISO date from a stream title, None if it has none
+def titleDate(title):
+    match = TITLE_DATE.search(title)
+    if not match:
+        return None
+    month, day, year = (int(part) for part in match.groups())
+    try:
+        return Date(2000 + year, month, day).isoformat()
+    except ValueError:
+        return None
+
+
+# Pull any streams newer than the newest one we know about. Returns how many
+# were added.
+def refresh(channel_id=None):
+    global _last_refresh
+    channel_id = channel_id or os.environ["CHANNEL_ID"]
+    with _lock:
+        _last_refresh = time.time()
+        conn = connect()
+        limit = 0 if conn.execute(LAST_SEQ).fetchone()[0] else FIRST_LIMIT
+        found = []
+        videos = scrapetube.get_channel(channel_id, "", limit, 1, "newest", "streams")
+        for video in videos:
+            if conn.execute(KNOWN, (video["videoId"],)).fetchone():
+                videos.close()
+                break
+            title = video["title"]["runs"][0]["text"]
+            found.append((video["videoId"], titleDate(title), title))
+        # Found newest first; number them so later streams get higher seq
+        seq = conn.execute(LAST_SEQ).fetchone()[0]
+        rows = []
+        for video_id, date, title in reversed(found):
+            seq += 1
+            rows.append((video_id, date, title, seq))
+        conn.executemany(INSERT, rows)
+        return len(rows)
+
+
+# Refresh on a background thread, unless one ran in the last MIN_INTERVAL seconds
+def refreshSoon():
+    if time.time() - _last_refresh < MIN_INTERVAL or _lock.locked():
+        return
+
+    def run():
+        try:
+            refresh()
+        except Exception:
+            pass
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+# Video id of the livestream for an ISO date, straight from the index. A miss
+# schedules a background refresh so the stream is there next time.
+def find(date):
+    row = connect().execute(FIND, (date,)).fetchone()
+    if row:
+        return row[0]
+    refreshSoon()
+    return None
+
+
+def recent(limit=10):
+    return [video_id for (video_id,) in connect().execute(RECENT, (limit,))]
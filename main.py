@@ -15,22 +15,27 @@ import string
 import sys
 import threading
 import time
-from datetime import datetime
 from time import sleep
 from types import SimpleNamespace
 
 import requests
 from colorama import Fore, Style
-from dateutil.parser import parse
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 from oauth2client.client import flow_from_clientsecrets
 from oauth2client.file import Storage
 from oauth2client.tools import run_flow
 from pyfiglet import Figlet
 
+import backfill
+import bulletins
 import classes
+import jobs
+import livestreams
+import siteindex
+import store
+import transcripts
 
 if not os.path.exists("/.dockerenv"):
     # Load enviroment variables from .env if it exists
@@ -108,9 +113,7 @@ def getSpeakers():
         for file in content:
             if file["type"] == "file":
                 preachers.append(file["name"][:-3].replace("-", " ").title())
-    with open("data/speakers.txt", "w") as f:
-        f.write(str(preachers))
-        f.close()
+    store.setSpeakers(preachers)
 
 
 def getSeries():
@@ -123,82 +126,39 @@ def getSeries():
     for item in serieses:
         title = item["node"]["title"]
         series.append(title)
-    with open("data/series.txt", "w") as f:
-        f.write(str(series))
-        f.close()
+    store.setSeries(series)
 
 
 def getSermons():
-    # Get Bulletins
-    bulletins = []
-    response = requests.get(
-        "https://coventrypca.church/assets/data/bulletins/index.json"
-    )
-    json = response.json()
-    bulletins_raw = json["data"]["bulletins"]["edges"]
-    # Grab bulletin for specific date:
-    for item in bulletins_raw:
-        date = item["node"]["date"]
-        bulletins.append(date)
-    num = 2
-    while num < 10:
-        response = requests.get(
-            f"https://coventrypca.church/assets/data/bulletins/{num}/index.json"
-        )
-        try:
-            json = response.json()
-        except:
-            break
-        bulletins_raw = json["data"]["bulletins"]["edges"]
-        # Grab bulletin for specific date:
-        for item in bulletins_raw:
-            date = item["node"]["date"]
-            bulletins.append(date)
-        num += 1
-    # Get Sermons
-    sermons = []
-    response = requests.get(
-        "https://coventrypca.church/assets/data/sermons/all/index.json"
-    )
-    json = response.json()
-    sermons_raw = json["data"]["sermons"]["edges"]
-    # Grab bulletin for specific date:
-    for sermon in sermons_raw:
-        date = sermon["node"]["date"]
-        sermons.append(date)
-    num = 2
-    while num < 10:
-        response = requests.get(
-            f"https://coventrypca.church/assets/data/sermons/all/{num}/index.json"
-        )
-        try:
-            json = response.json()
-        except:
-            break
-        sermons_raw = json["data"]["sermons"]["edges"]
-        # Grab bulletin for specific date:
-        for sermon in sermons_raw:
-            date = sermon["node"]["date"]
-            sermons.append(date)
-        num += 1
+    # Bulletins with no published sermon yet, newest first
+    index = siteindex.index()
     final = dict()
-    for bulletin in bulletins:
-        if not bulletin in sermons:
-            date_int = datetime.strftime(parse(bulletin), "%Y-%m-%d")
-            final[bulletin] = date_int
-    with open("data/sermons.txt", "w") as f:
-        f.write(str(final))
-        f.close()
+    for date_int in reversed(index.missing()):
+        final[index.labels[date_int]] = date_int
+    store.setSermons(final)
+
+
+# Pick up new livestreams and warm the transcript cache for the recent ones so
+# sermon lookups and timing guesses don't have to go to Youtube
+def refreshLivestreams():
+    try:
+        livestreams.refresh()
+    except Exception:
+        pass
+    transcripts.prefetch(livestreams.recent(10))
 
 
 # Refresh local data
 def refreshData():
     log("Fetching latest data...")
+    siteindex.refresh()
     getSermons()
     getSeries()
     getSpeakers()
     log("✅\n")
     open("logs/app.log", "w")
+    threading.Thread(target=refreshLivestreams, daemon=True).start()
+    threading.Thread(target=bulletins.preparse, daemon=True).start()
 
 
 # Generate random API key
@@ -239,29 +199,27 @@ if "process" not in os.listdir():
 app = Flask(__name__)
 CORS(app)
 
+# Each gunicorn worker runs its share of the upload queue
+if __name__ != "__main__":
+    jobs.start()
+
 
 # Get list of sermons with available metadata
 @app.route("/pcc/v1/sermons", methods=["GET"])
 def get_sermons():
-    with open("data/sermons.txt", "r") as f:
-        sermons = f.read()
-    return json.loads(sermons.replace("'", '"')), 200
+    return jsonify(store.getSermons()), 200
 
 
 # Get list of series
 @app.route("/pcc/v1/series", methods=["GET"])
 def get_series():
-    with open("data/series.txt", "r") as f:
-        series = f.read()
-    return jsonify(json.loads(series.replace("'", '"'))), 200
+    return jsonify(store.getSeries()), 200
 
 
 # Get list of speakers
 @app.route("/pcc/v1/speakers", methods=["GET"])
 def get_speakers():
-    with open("data/speakers.txt", "r") as f:
-        speakers = f.read()
-    return jsonify(json.loads(speakers.replace("'", '"'))), 200
+    return jsonify(store.getSpeakers()), 200
 
 
 # Get sermon details
@@ -270,6 +228,8 @@ def get_sermon(sermon_date):
     payload = {"date": sermon_date}
     sermon = classes.Sermon(payload)
     sermon.isUploaded()
+    if not (sermon.start and sermon.end):
+        sermon.guessTiming()
     return {
         "title": sermon.title,
         "text": sermon.text,
@@ -279,6 +239,7 @@ def get_sermon(sermon_date):
         "uploaded": sermon.uploaded,
         "guessStart": sermon.start,
         "guessEnd": sermon.end,
+        "guessConfidence": sermon.confidence,
     }, 200
 
 
@@ -314,6 +275,40 @@ def get_status():
         return "no logs"
 
 
+# Structured status for an upload job. Pass ?since=<revision>&wait=<seconds> to
+# long-poll until the job's progress changes.
+@app.route("/pcc/v1/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    since = request.args.get("since", type=int)
+    wait = min(request.args.get("wait", 0, type=float), 60)
+    job = jobs.get(job_id, since, wait)
+    if not job:
+        return jsonify({"error": "No such job"}), 404
+    return jsonify(job), 200
+
+
+# Same job status as a Server-Sent Events stream, one event per change
+@app.route("/pcc/v1/jobs/<job_id>/events", methods=["GET"])
+def get_job_events(job_id):
+    if not jobs.get(job_id):
+        return jsonify({"error": "No such job"}), 404
+
+    def stream():
+        revision = -1
+        while True:
+            job = jobs.get(job_id, revision, 15)
+            if job["revision"] != revision:
+                revision = job["revision"]
+                yield f"id: {revision}\ndata: {json.dumps(job)}\n\n"
+            else:
+                # Keep proxies from closing an idle stream
+                yield ": keepalive\n\n"
+            if job["state"] in ("done", "failed"):
+                return
+
+    return Response(stream(), mimetype="text/event-stream"), 200
+
+
 # Sermon upload route
 @app.route("/pcc/v1/upload", methods=["POST"])
 def posted():
@@ -323,15 +318,12 @@ def posted():
     key = args["API_Key"] + "\n"
     if key in api_keys:
         try:
-            sermon = classes.Sermon(args)
-            log("Uploading sermon for " + args["date"] + ":\n")
-            if sermon.isUploaded() == True:
+            if siteindex.index().isUploaded(args["date"]):
                 return "Error! Sermon already uploaded."
-            else:
-                upload_thread = threading.Thread(target=sermon.upload)
-                upload_thread.start()
-                return "success"
-            return "Processing request...Check status page in a few minutes for rebuilding. If there is no rebuild, check the server logs."
+            job_id, created = jobs.enqueue(args)
+            if created:
+                log("Queued sermon upload for " + args["date"] + "\n")
+            return jsonify({"job": job_id, "queued": created}), 202
         except:
             return "Upload POST failed!"
     else:
@@ -339,11 +331,33 @@ def posted():
         return "Invalid API Key!"
 
 
+# Upload every sermon the website is still missing. Takes the same target flags
+# as an upload (youtube, sermonAudio, website; all on by default) and an optional
+# limit, and runs in the background; GET reports how it's going.
+@app.route("/pcc/v1/backfill", methods=["GET", "POST"])
+def backfill_sermons():
+    if request.method == "GET":
+        return jsonify(backfill.status()), 200
+    args = json.loads(request.get_data().decode("UTF-8"))
+    with open("data/api.txt", "r") as api:
+        api_keys = api.readlines()
+    key = args.get("API_Key", "") + "\n"
+    if key not in api_keys:
+        log("Invalid API key used!")
+        return "Invalid API Key!"
+    targets = {t: bool(args[t]) for t in backfill.TARGETS if t in args}
+    started = backfill.start(targets, args.get("limit"))
+    if started is None:
+        return jsonify({"error": "A backfill is already running"}), 409
+    dates, deferred = started
+    return jsonify({"dates": dates, "deferred": deferred}), 202
+
+
 # Single command to serve API, mostly for threading purposes
 def serveAPI():
     print(Fore.GREEN + "Started serving API on port 3167!" + Fore.RESET)
     os.system(
-        "gunicorn -b 0.0.0.0:3167 main:app --workers=3 --enable-stdio-inheritance --error-logfile logs/error.log --access-logfile logs/access.log --log-level info"
+        "gunicorn -b 0.0.0.0:3167 main:app --workers=3 --threads=8 --enable-stdio-inheritance --error-logfile logs/error.log --access-logfile logs/access.log --log-level info"
     )
 
 
@@ -380,6 +394,13 @@ if __name__ == "__main__":
         default=False,
         help="Reauthenticate with Google OAuth2 for Youtube",
     )
+    parser.add_argument(
+        "-backfill",
+        action="store_true",
+        dest="backfill",
+        default=False,
+        help="Upload every sermon the website is missing, as far as today's Youtube quota allows",
+    )
     results = parser.parse_args()
     if results.auto:
         # Setup local data cache
@@ -395,5 +416,9 @@ if __name__ == "__main__":
         exit()
     elif results.auth:
         youtube_reauth()
+    elif results.backfill:
+        siteindex.refresh()
+        if backfill.start(wait=True) is None:
+            exit("A backfill is already running!")
     else:
         exit("Please pass in a valid mode of operation! Run -h for instruction.")
@@ -0,0 +1,82 @@
+import subprocess
+import time
+from datetime import timedelta
+
+# ffmpeg and noisereducer wrappers shared by the API and the livestream script.
+# The source video is read once: a single ffmpeg run writes both the trimmed
+# video and the mono PCM WAV the denoiser wants, and the final MP3 is encoded
+# once, straight from the denoiser output.
+
+NOISE_PROFILE = "data/noise.wav"
+NOISEREDUCER = "data/noisereducer"
+
+
+# Normalise a timestamp (seconds, timedelta or "H:MM:SS") to "HH:MM:SS"
+def timestamp(value):
+    if isinstance(value, timedelta):
+        value = value.total_seconds()
+    if isinstance(value, str):
+        if ":" in value:
+            return value
+        value = float(value)
+    return time.strftime("%H:%M:%S", time.gmtime(value))
+
+
+# Timestamp (seconds, timedelta or "H:MM:SS") as a number of seconds
+def seconds(value):
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, str) and ":" in value:
+        total = 0.0
+        for part in value.split(":"):
+            total = total * 60 + float(part)
+        return total
+    return float(value)
+
+
+def run(command):
+    subprocess.run(
+        command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True
+    )
+
+
+# One pass over source: copy the start-end section to video (if given) and write
+# the first audio track of that section as mono 16-bit WAV to wav (if given)
+def split(source, video=None, wav=None, start=None, end=None):
+    command = ["ffmpeg", "-y"]
+    # Seeking on the input skips straight to the section instead of reading the
+    # whole livestream up to it
+    if start is not None:
+        command += ["-ss", timestamp(start)]
+    if end is not None:
+        command += ["-to", timestamp(end)]
+    command += ["-i", source]
+    if video:
+        command += ["-map", "0", "-c", "copy", video]
+    if wav:
+        command += ["-map", "0:a:0", "-vn", "-ac", "1", "-c:a", "pcm_s16le", wav]
+    run(command)
+
+
+def denoise(wav, output):
+    run(
+        [
+            NOISEREDUCER,
+            "-i",
+            wav,
+            "-o",
+            output,
+            "-p",
+            NOISE_PROFILE,
+            "--noiseGain",
+            "12",
+            "--sensitivity",
+            "6",
+            "--smoothing",
+            "3",
+        ]
+    )
+
+
+def encodeMp3(wav, mp3):
+    run(["ffmpeg", "-y", "-i", wav, "-c:a", "libmp3lame", "-b:a", "128k", mp3])
@@ -6,59 +6,103 @@
 # author: rjones30@gmail.com
 # version: october 9, 2023
 
+import argparse
+import json
 import os
-import sys
 import shutil
 import pandas
 import subprocess
-from pydub import AudioSegment
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadError
+
+import media
+
+class PostprocessError(Exception):
+    """
+    Raised by the processing steps in place of exiting, so that one
+    bad row only fails its own sermon and the rest carry on.
+    """
+
+# Downloads land straight in sermons/ under yt-dlp's usual name. Partial
+# downloads are kept as .part files there and picked up where they left off
+# when the script is run again.
+YDL_OPTIONS = {
+    "outtmpl": "sermons/%(title)s [%(id)s].%(ext)s",
+    "continuedl": True,
+    "quiet": True,
+    "noprogress": True,
+}
+# Saved livestream file name per url, so a rerun finds finished downloads
+# without asking youtube for the metadata again
+FILENAME_CACHE = "process/livestream-filenames.json"
+
+livestream_infos = {}
+
+def load_filenames():
+    try:
+        with open(FILENAME_CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_filename(url, filename):
+    filenames = load_filenames()
+    filenames[url] = filename
+    with open(FILENAME_CACHE, "w") as f:
+        json.dump(filenames, f, indent=1)
+
+def livestream_info(ydl, url):
+    """
+    Return the yt-dlp metadata for the livestream at url, resolving it
+    only the first time a url is seen in this run. Only the download
+    stage calls this, so the cache needs no locking.
+    """
+    if url not in livestream_infos:
+        livestream_infos[url] = ydl.extract_info(url, download=False)
+    return livestream_infos[url]
 
 def download_livestream(sermon):
     """
     Download the recording from a livestream event, using the url
     found in argument sermon['livestream']. The result is a new
-    mkv file saved in the sermons directory under the current
+    video file saved in the sermons directory under the current
     working directory. The relatve pathname is the return value.
     """
-    resp = subprocess.run(
-      [
-        "/usr/local/bin/yt-dlp",
-        "--print", "filename",
-        sermon['livestream'],
-      ],
-      stdout=subprocess.PIPE)
-    if resp.returncode != 0:
-        print("download_livestream error - cannot download livestream from",
-              sermon['livestream'])
-        print("Invalid url in livestream column of csv file?")
-        sys.exit(1)
-    filename = resp.stdout.decode().rstrip()
-    if os.path.exists(f"sermons/{filename}"):
+    url = sermon['livestream']
+    filename = load_filenames().get(url)
+    if filename and os.path.exists(filename):
         print(f"download_livestream info - {filename} already downloaded, using existing copy")
-        return f"sermons/{filename}"
-    else:
-        print(f"download_livestream info - {filename} not found in sermons/, downloading from youtube")
-    resp = subprocess.run(
-      [
-        "/usr/local/bin/yt-dlp",
-        sermon['livestream'],
-      ])
-    if resp.returncode != 0:
-        print("download_livestream error - cannot download livestream from",
-              sermon['livestream'])
-        print("Invalid url in livestream column of csv file?")
-        sys.exit(2)
-    shutil.move(filename, f"sermons/{filename}")
-    return f"sermons/{filename}"
+        return filename
+    try:
+        with YoutubeDL(YDL_OPTIONS) as ydl:
+            info = livestream_info(ydl, url)
+            filename = ydl.prepare_filename(info)
+            if os.path.exists(filename):
+                print(f"download_livestream info - {filename} already downloaded, using existing copy")
+            else:
+                print(f"download_livestream info - {filename} not found in sermons/, downloading from youtube")
+                # Reuse the metadata we already have rather than extracting
+                # again, the same way yt-dlp's --load-info-json does
+                result = ydl.process_ie_result(dict(info), download=True)
+                downloads = result.get("requested_downloads") or [{}]
+                filename = downloads[0].get("filepath") or filename
+    except DownloadError:
+        raise PostprocessError(
+          "download_livestream error - cannot download livestream from "
+          f"{url}. Invalid url in livestream column of csv file?")
+    save_filename(url, filename)
+    return filename
 
-def process_video(mkvfile, sermon):
+def process_video(mkvfile, sermon, workspace):
     """
     Truncate the video in the livestream image to the time between
     the sermon start and end times recorded in the "sermon starts"
     and "sermon ends" columns of the sermon argument, and return
-    the path to the output mp4 file.
+    the path to the output mp4 file in the workspace directory.
     """
-    filename = "sermon_part.mp4"
+    filename = os.path.join(workspace, "sermon_part.mp4")
     resp = subprocess.run(
       [
         "ffmpeg", "-y", "-i", mkvfile,
@@ -68,84 +112,132 @@ def process_video(mkvfile, sermon):
         filename,
       ])
     if resp.returncode != 0:
-        print("process_video error - cannot truncate livestream image",
-              mkvfile)
-        sys.exit(2)
+        raise PostprocessError(
+          f"process_video error - cannot truncate livestream image {mkvfile}")
     return filename
 
-def process_audio(mp4file, sermon):
+def process_audio(mp4file, sermon, workspace):
     """
     Apply a denoise filter to the sound track contained in the mp4file
     input file, encode it in new audio (mp3) file, and return the path
-    Truncate the video in the livestream image to the time between
-    the sermon start and end times recorded in the "sermon starts"
-    and "sermon ends" columns of the sermon argument, and return
-    the path to the output mp4 file.
+    to the output mp3 file. The audio is streamed through ffmpeg and
+    the noise reducer on disk, never loaded into memory here. All the
+    intermediate files live in the workspace directory.
     """
-    filename = "sermon_part.mp3"
-    resp = subprocess.run(
-      [
-        "ffmpeg", "-y", "-i", mp4file,
-        filename,
-      ])
-    if resp.returncode != 0:
-        print("process_audio error - cannot extract audio from mp4 video",
-              mp4file)
-        sys.exit(2)
-    sound = AudioSegment.from_mp3(filename)
-    sound = sound.set_channels(1)
-    sound.export("process/reduce.wav", format="wav")
-    resp = subprocess.run(
-      [
-        "data/noisereducer",
-        "-i", "process/reduce.wav",
-        "-o", "process/denoised.wav",
-        "-p", "data/noise.wav",
-        "--noiseGain", "12",
-        "--sensitivity", "6",
-        "--smoothing", "3",
-      ])
-    if resp.returncode != 0:
-        print("process_audio error - cannot run noisereducer on wav audio",
-              "process/reduce.wav")
-        sys.exit(2)
-    os.remove(filename)
-    new_sound = AudioSegment.from_wav("process/denoised.wav")
-    new_sound.export(filename, codec="libmp3lame")
-    os.remove("process/denoised.wav")
-    os.remove("process/reduce.wav")
+    filename = os.path.join(workspace, "sermon_part.mp3")
+    reduce = os.path.join(workspace, "reduce.wav")
+    denoised = os.path.join(workspace, "denoised.wav")
+    try:
+        media.split(mp4file, wav=reduce)
+    except subprocess.CalledProcessError:
+        raise PostprocessError(
+          f"process_audio error - cannot extract audio from mp4 video {mp4file}")
+    try:
+        media.denoise(reduce, denoised)
+    except subprocess.CalledProcessError:
+        raise PostprocessError(
+          f"process_audio error - cannot run noisereducer on wav audio {reduce}")
+    try:
+        media.encodeMp3(denoised, filename)
+    except subprocess.CalledProcessError:
+        raise PostprocessError(
+          f"process_audio error - cannot encode denoised audio to mp3 {denoised}")
+    os.remove(denoised)
+    os.remove(reduce)
     return filename
 
-headings = []
-sermons = []
-sermon_data = pandas.read_csv("pcc-sermons.csv")
-headings = sermon_data.columns.values
-for i in range(999999999):
-    sermon = {}
+def pending_sermons(csvfile):
+    """
+    Read the sermon spreadsheet and return, as a list of dicts keyed
+    by column heading, the rows that have a title, preacher and
+    livestream url but are still missing their video or audio.
+    """
+    sermon_data = pandas.read_csv(csvfile)
+    wanted = (sermon_data['title'].notna()
+              & sermon_data['preacher'].notna()
+              & (sermon_data['video'].isna() | sermon_data['audio'].isna())
+              & sermon_data['livestream'].notna())
+    todo = sermon_data[wanted]
+    print(f"{len(todo)} of {len(sermon_data)} sermons in {csvfile} need processing")
+    headings = list(todo.columns)
+    return [dict(zip(headings, row))
+            for row in todo.itertuples(index=False, name=None)]
+
+def sermon_name(sermon):
+    """
+    Return the file name (without extension) for the processed sermon,
+    e.g. "2023.10.08A Title - Preacher".
+    """
+    mon, day, year = (int(part) for part in sermon['date'].split('/'))
+    title = str(sermon['title']).replace("/", "-")
+    return f"{year}.{mon:02d}.{day:02d}A {title} - {sermon['preacher']}"
+
+def postprocess(sermon, download):
+    """
+    Cut and denoise one sermon once its livestream download (a future
+    from the download stage) has finished, working in a private
+    directory under process/, and move the results into sermons/.
+    """
+    sername = sermon_name(sermon)
+    workspace = os.path.join("process", sername)
+    os.makedirs(workspace, exist_ok=True)
     try:
-        for heading in headings:
-            sermon[heading] = sermon_data.loc[i, heading]
-    except:
-        print(f"quitting after {i} rows read")
-        break
-    sermons.append(sermon)
-
-for sermon in sermons:
-    if not pandas.isna(sermon['title']) and not pandas.isna(sermon['preacher']):
-        if pandas.isna(sermon['video']) or pandas.isna(sermon['audio']):
-            if not pandas.isna(sermon['livestream']):
-                mon = int(sermon['date'].split('/')[0])
-                day = int(sermon['date'].split('/')[1])
-                year = int(sermon['date'].split('/')[2])
-                sername = f"{year}.{mon:02d}.{day:02d}A {sermon['title']} - {sermon['preacher']}"
-                print("working on sermon", sername)
-                mkvfile = download_livestream(sermon)
-                print("download_livestream returns", mkvfile)
-                mp4file = process_video(mkvfile, sermon)
-                print("process_video returns", mp4file)
-                mp3file = process_audio(mp4file, sermon)
-                print("process_audio returns", mp3file)
-                shutil.move(mp4file, f"sermons/{sername}.mp4")
-                shutil.move(mp3file, f"sermons/{sername}.mp3")
-                print(f"now you can upload sermon video from sermons/{sername}.mp4")
-                print(f"now you can upload sermon audio from sermons/{sername}.mp3")
+        mkvfile = download.result()
+        print(f"{sername}: download_livestream returns", mkvfile)
+        mp4file = process_video(mkvfile, sermon, workspace)
+        print(f"{sername}: process_video returns", mp4file)
+        mp3file = process_audio(mp4file, sermon, workspace)
+        print(f"{sername}: process_audio returns", mp3file)
+        shutil.move(mp4file, f"sermons/{sername}.mp4")
+        shutil.move(mp3file, f"sermons/{sername}.mp3")
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+    print(f"now you can upload sermon video from sermons/{sername}.mp4")
+    print(f"now you can upload sermon audio from sermons/{sername}.mp3")
+
+def main():
+    """
+    Livestreams are downloaded one at a time, in spreadsheet order, while
+    up to --jobs sermons that are already downloaded are cut and denoised,
+    so the download of sermon N+1 overlaps the processing of sermon N.
+    Downloads run at most one sermon ahead of the processing slots, so
+    the livestreams waiting to be cut never pile up on disk.
+    """
+    parser = argparse.ArgumentParser(
+      description="Cut and denoise PCC livestream recordings listed in a csv file")
+    parser.add_argument("csvfile", nargs="?", default="pcc-sermons.csv")
+    parser.add_argument("-j", "--jobs", type=int,
+                        default=max(1, (os.cpu_count() or 2) // 2),
+                        help="sermons to cut and denoise at the same time")
+    args = parser.parse_args()
+    os.makedirs("sermons", exist_ok=True)
+    os.makedirs("process", exist_ok=True)
+    sermons = pending_sermons(args.csvfile)
+    failed = []
+    lookahead = threading.Semaphore(args.jobs + 1)
+    with ThreadPoolExecutor(max_workers=1) as downloads, \
+         ThreadPoolExecutor(max_workers=args.jobs) as workers:
+        work = []
+        for sermon in sermons:
+            lookahead.acquire()
+            print("working on sermon", sermon_name(sermon))
+            download = downloads.submit(download_livestream, sermon)
+            job = workers.submit(postprocess, sermon, download)
+            job.add_done_callback(lambda job: lookahead.release())
+            work.append((sermon, job))
+        for sermon, job in work:
+            try:
+                job.result()
+            except PostprocessError as e:
+                print(e)
+                failed.append(sermon_name(sermon))
+            except Exception as e:
+                # Anything unexpected still only fails its own sermon
+                print(f"{sermon_name(sermon)}: unexpected error - {e!r}")
+                failed.append(sermon_name(sermon))
+    if failed:
+        print(f"{len(failed)} sermons failed:", ", ".join(failed))
+        raise SystemExit(2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import json
+import threading
+import time
+
+import store
+
+# Structured per-job progress: one JSON document per job holding the current
+# stage and, for every stage, its state, timings and whatever counters it
+# reports (percent, bytes, ...). Each write bumps the job's revision so readers
+# can wait for the next change instead of polling a log file.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS progress (
+    job TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    revision INTEGER NOT NULL
+);
+"""
+
+SELECT = "SELECT data, revision FROM progress WHERE job = ?"
+UPSERT = """
+INSERT INTO progress (job, data, revision) VALUES (?, ?, 1)
+ON CONFLICT (job) DO UPDATE SET data = excluded.data, revision = revision + 1
+"""
+
+# Frequent updates such as download percentages are written at most this often
+THROTTLE = 1.0
+
+_lock = threading.Lock()
+_last_write = {}
+
+
+def connect():
+    store.ensure(SCHEMA)
+    return store.connect()
+
+
+# Returns (progress dict, revision); revision is 0 for a job with no progress yet
+def get(job):
+    row = connect().execute(SELECT, (job,)).fetchone()
+    if not row:
+        return {"stage": None, "stages": {}}, 0
+    return json.loads(row[0]), row[1]
+
+
+def _write(job, stage, fields, force=True):
+    if not job:
+        return
+    now = time.time()
+    with _lock:
+        if not force and now - _last_write.get((job, stage), 0) < THROTTLE:
+            return
+        _last_write[(job, stage)] = now
+        conn = connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(SELECT, (job,)).fetchone()
+            data = json.loads(row[0]) if row else {"stage": None, "stages": {}}
+            if stage is None:
+                data.update(fields)
+            else:
+                data["stages"].setdefault(stage, {}).update(fields)
+                if fields.get("state") == "running":
+                    data["stage"] = stage
+            conn.execute(UPSERT, (job, json.dumps(data)))
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def start(job, stage, **fields):
+    _write(job, stage, dict(fields, state="running", started=time.time()))
+
+
+# Record counters for a running stage; throttled unless force is set
+def update(job, stage, force=False, **fields):
+    _write(job, stage, fields, force)
+
+
+def finish(job, stage, ok=True, **fields):
+    data, _ = get(job) if job else ({"stages": {}}, 0)
+    started = data["stages"].get(stage, {}).get("started")
+    now = time.time()
+    fields = dict(fields, state="done" if ok else "failed", finished=now)
+    if started:
+        fields["seconds"] = round(now - started, 3)
+    _write(job, stage, fields)
+
+
+def skip(job, stage, reason=None):
+    _write(job, stage, {"state": "skipped", "reason": reason})
+
+
+# Record the overall job state so waiters wake up on queue transitions too
+def state(job, state, error=None):
+    _write(job, None, {"state": state, "error": error})
+
+
+# Block until the job's revision moves past since, or timeout seconds pass
+def wait(job, since, timeout):
+    deadline = time.time() + timeout
+    while True:
+        data, revision = get(job)
+        if revision > since or time.time() >= deadline:
+            return data, revision
+        time.sleep(0.5)
@@ -0,0 +1,73 @@
+import os
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import store
+
+# Youtube Data API quota, tracked in the shared store so every process sees the
+# same count. A video upload costs 1600 units and each project gets 10000 units a
+# day, reset at midnight Pacific time.
+
+DAILY = int(os.environ.get("YOUTUBE_DAILY_QUOTA", "10000"))
+UPLOAD_COST = 1600
+RESET_ZONE = ZoneInfo("America/Los_Angeles")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS youtube_quota (
+    day TEXT PRIMARY KEY,
+    units INTEGER NOT NULL
+);
+"""
+
+USED = "SELECT units FROM youtube_quota WHERE day = ?"
+SPEND = """
+INSERT INTO youtube_quota (day, units) VALUES (?, ?)
+ON CONFLICT (day) DO UPDATE SET units = units + excluded.units
+"""
+
+
+def connect():
+    store.ensure(SCHEMA)
+    return store.connect()
+
+
+def today():
+    return datetime.now(RESET_ZONE).date().isoformat()
+
+
+def used():
+    row = connect().execute(USED, (today(),)).fetchone()
+    return row[0] if row else 0
+
+
+def remaining():
+    return max(DAILY - used(), 0)
+
+
+# How many more videos can go up today
+def uploadsLeft():
+    return remaining() // UPLOAD_COST
+
+
+# Book units against today's quota. Returns False, booking nothing, if they
+# don't fit.
+def spend(units=UPLOAD_COST):
+    conn = connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(USED, (today(),)).fetchone()
+        if (row[0] if row else 0) + units > DAILY:
+            conn.execute("COMMIT")
+            return False
+        conn.execute(SPEND, (today(), units))
+        conn.execute("COMMIT")
+    except:
+        conn.execute("ROLLBACK")
+        raise
+    return True
+
+
+# Youtube says the quota is gone, whatever our count says; book the rest of the day
+def exhaust():
+    conn = connect()
+    conn.execute(SPEND, (today(), remaining()))
@@ -1,10 +1,23 @@
+import asyncio
 import json
+import re
 import time
-from typing import Generator
+from collections import deque
+from typing import AsyncGenerator, Generator, List, Tuple
 
+import httpx
 import requests
 from typing_extensions import Literal
 
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.101 Safari/537.36"
+
 type_property_map = {
     "videos": "videoRenderer",
     "streams": "videoRenderer",
@@ -53,6 +66,17 @@ def get_channel(
             ``"streams"``: Streams
     """
 
+    url, api_endpoint, selector = channel_request(
+        channel_id, channel_url, sort_by, content_type
+    )
+    videos = get_videos(url, api_endpoint, selector, limit, sleep)
+    for video in videos:
+        yield video
+
+
+def channel_request(
+    channel_id: str, channel_url: str, sort_by: str, content_type: str
+) -> Tuple[str, str, str]:
     sort_by_map = {"newest": "dd", "oldest": "da", "popular": "p"}
     url = "{url}/{content_type}?view=0&sort={sort_by}&flow=grid".format(
         url=channel_url or f"https://www.youtube.com/channel/{channel_id}",
@@ -60,11 +84,7 @@ def get_channel(
         sort_by=sort_by_map[sort_by],
     )
     api_endpoint = "https://www.youtube.com/youtubei/v1/browse"
-    videos = get_videos(
-        url, api_endpoint, type_property_map[content_type], limit, sleep
-    )
-    for video in videos:
-        yield video
+    return url, api_endpoint, type_property_map[content_type]
 
 
 def get_playlist(
@@ -85,13 +105,18 @@ def get_playlist(
             Defaults to 1.
     """
 
-    url = f"https://www.youtube.com/playlist?list={playlist_id}"
-    api_endpoint = "https://www.youtube.com/youtubei/v1/browse"
-    videos = get_videos(url, api_endpoint, "playlistVideoRenderer", limit, sleep)
+    url, api_endpoint, selector = playlist_request(playlist_id)
+    videos = get_videos(url, api_endpoint, selector, limit, sleep)
     for video in videos:
         yield video
 
 
+def playlist_request(playlist_id: str) -> Tuple[str, str, str]:
+    url = f"https://www.youtube.com/playlist?list={playlist_id}"
+    api_endpoint = "https://www.youtube.com/youtubei/v1/browse"
+    return url, api_endpoint, "playlistVideoRenderer"
+
+
 def get_search(
     query: str,
     limit: int = 0,
@@ -126,6 +151,15 @@ def get_search(
             ``"video"|"channel"|"playlist"|"movie"``. Defaults to "video".
     """
 
+    url, api_endpoint, selector = search_request(query, sort_by, results_type)
+    videos = get_videos(url, api_endpoint, selector, limit, sleep)
+    for video in videos:
+        yield video
+
+
+def search_request(
+    query: str, sort_by: str, results_type: str
+) -> Tuple[str, str, str]:
     sort_by_map = {
         "relevance": "A",
         "upload_date": "I",
@@ -143,41 +177,27 @@ def get_search(
     param_string = f"CA{sort_by_map[sort_by]}SAhA{results_type_map[results_type][0]}"
     url = f"https://www.youtube.com/results?search_query={query}&sp={param_string}"
     api_endpoint = "https://www.youtube.com/youtubei/v1/search"
-    videos = get_videos(
-        url, api_endpoint, results_type_map[results_type][1], limit, sleep
-    )
-    for video in videos:
-        yield video
+    return url, api_endpoint, results_type_map[results_type][1]
 
 
 def get_videos(
     url: str, api_endpoint: str, selector: str, limit: int, sleep: int
 ) -> Generator[dict, None, None]:
     session = requests.Session()
-    session.headers[
-        "User-Agent"
-    ] = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.101 Safari/537.36"
+    session.headers["User-Agent"] = USER_AGENT
     is_first = True
     quit = False
     count = 0
     while True:
         if is_first:
-            html = get_initial_data(session, url)
-            client = json.loads(
-                get_json_from_html(html, "INNERTUBE_CONTEXT", 2, '"}},') + '"}}'
-            )["client"]
-            api_key = get_json_from_html(html, "innertubeApiKey", 3)
+            client, api_key, data = get_initial_page(session, url)
             session.headers["X-YouTube-Client-Name"] = "1"
             session.headers["X-YouTube-Client-Version"] = client["clientVersion"]
-            data = json.loads(
-                get_json_from_html(html, "var ytInitialData = ", 0, "};") + "}"
-            )
-            next_data = get_next_data(data)
             is_first = False
         else:
             data = get_ajax_data(session, api_endpoint, api_key, next_data, client)
-            next_data = get_next_data(data)
-        for result in get_videos_items(data, selector):
+        items, next_data = get_page(data, selector)
+        for result in items:
             try:
                 count += 1
                 yield result
@@ -196,6 +216,235 @@ def get_videos(
     session.close()
 
 
+async def aget_channel(
+    channel_id: str = "",
+    channel_url: str = "",
+    limit: int = 0,
+    rate: float = 1,
+    burst: int = 2,
+    sort_by: Literal["newest", "oldest", "popular"] = "newest",
+    content_type: Literal["videos", "shorts", "streams"] = "videos",
+) -> AsyncGenerator[dict, None]:
+
+    """Async version of ``get_channel``.
+
+    The next page is requested while the current one is still being consumed,
+    and requests are paced by a token bucket instead of a fixed sleep.
+
+    Parameters:
+        rate (``float``, *optional*):
+            Average requests per second to youtube. Defaults to 1.
+
+        burst (``int``, *optional*):
+            How many requests may go out back to back before ``rate`` applies.
+            Defaults to 2.
+
+        The other parameters are the same as for ``get_channel``.
+    """
+
+    url, api_endpoint, selector = channel_request(
+        channel_id, channel_url, sort_by, content_type
+    )
+    async for video in aget_videos(url, api_endpoint, selector, limit, rate, burst):
+        yield video
+
+
+async def aget_playlist(
+    playlist_id: str, limit: int = 0, rate: float = 1, burst: int = 2
+) -> AsyncGenerator[dict, None]:
+
+    """Async version of ``get_playlist``. See ``aget_channel`` for ``rate`` and
+    ``burst``."""
+
+    url, api_endpoint, selector = playlist_request(playlist_id)
+    async for video in aget_videos(url, api_endpoint, selector, limit, rate, burst):
+        yield video
+
+
+async def aget_search(
+    query: str,
+    limit: int = 0,
+    rate: float = 1,
+    burst: int = 2,
+    sort_by: Literal["relevance", "upload_date", "view_count", "rating"] = "relevance",
+    results_type: Literal["video", "channel", "playlist", "movie"] = "video",
+) -> AsyncGenerator[dict, None]:
+
+    """Async version of ``get_search``. See ``aget_channel`` for ``rate`` and
+    ``burst``."""
+
+    url, api_endpoint, selector = search_request(query, sort_by, results_type)
+    async for video in aget_videos(url, api_endpoint, selector, limit, rate, burst):
+        yield video
+
+
+class TokenBucket:
+    """Allows ``rate`` acquisitions per second on average, up to ``capacity`` at
+    once after a quiet spell."""
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def aget_videos(
+    url: str,
+    api_endpoint: str,
+    selector: str,
+    limit: int,
+    rate: float = 1,
+    burst: int = 2,
+) -> AsyncGenerator[dict, None]:
+    bucket = TokenBucket(rate, burst)
+    async with httpx.AsyncClient(
+        headers={"User-Agent": USER_AGENT}, timeout=30, follow_redirects=True
+    ) as session:
+        session.cookies.set("CONSENT", "YES+cb", domain=".youtube.com")
+        await bucket.acquire()
+        extractor = InitialDataExtractor()
+        async with session.stream("GET", url) as response:
+            async for chunk in response.aiter_text():
+                if extractor.feed(chunk):
+                    break
+        client, api_key, data = extractor.result()
+        session.headers["X-YouTube-Client-Name"] = "1"
+        session.headers["X-YouTube-Client-Version"] = client["clientVersion"]
+
+        async def fetch(next_data: dict) -> dict:
+            await bucket.acquire()
+            response = await session.post(
+                api_endpoint,
+                params={"key": api_key},
+                json=ajax_payload(next_data, client),
+            )
+            return response.json()
+
+        count = 0
+        pending = None
+        try:
+            while True:
+                items, next_data = get_page(data, selector)
+                # Start on the next page before handing out this one, unless
+                # this page already reaches the limit
+                if next_data and not (limit and count + len(items) >= limit):
+                    pending = asyncio.ensure_future(fetch(next_data))
+                for result in items:
+                    count += 1
+                    yield result
+                    if count == limit:
+                        return
+                if not pending:
+                    return
+                data = await pending
+                pending = None
+        finally:
+            if pending and not pending.done():
+                pending.cancel()
+
+
+def parse_initial_data(html: str) -> Tuple[dict, str, dict]:
+    client = json.loads(
+        get_json_from_html(html, "INNERTUBE_CONTEXT", 2, '"}},') + '"}}'
+    )["client"]
+    api_key = get_json_from_html(html, "innertubeApiKey", 3)
+    data = json.loads(get_json_from_html(html, "var ytInitialData = ", 0, "};") + "}")
+    return client, api_key, data
+
+
+def get_initial_page(session: requests.Session, url: str) -> Tuple[dict, str, dict]:
+    session.cookies.set("CONSENT", "YES+cb", domain=".youtube.com")
+    extractor = InitialDataExtractor()
+    with session.get(url, stream=True) as response:
+        response.encoding = response.encoding or "utf-8"
+        for chunk in response.iter_content(chunk_size=65536, decode_unicode=True):
+            if extractor.feed(chunk):
+                break
+    return extractor.result()
+
+
+_API_KEY = re.compile(r'"innertubeApiKey":\s*"([^"]*)"')
+_decoder = json.JSONDecoder()
+
+
+class InitialDataExtractor:
+    """Pulls ``INNERTUBE_CONTEXT``, ``innertubeApiKey`` and ``ytInitialData`` out
+    of a page as it downloads.
+
+    Each blob is cut out once the ``<script>`` holding it has closed (inline
+    scripts can't contain a literal ``</script>``), so no sentinel inside the
+    JSON is needed. ``feed`` returns True once everything is complete, so the
+    caller can stop reading the rest of the page.
+    """
+
+    MARKERS = {
+        "client": '"INNERTUBE_CONTEXT":',
+        "data": "var ytInitialData = ",
+    }
+
+    def __init__(self):
+        self.text = ""
+        # name -> (start of the JSON object, end of its script) once located
+        self.spans = {}
+        self.api_key = None
+        # Where to resume looking for each thing that hasn't shown up yet
+        self.search_from = {name: 0 for name in self.MARKERS}
+        self.api_key_from = 0
+
+    def feed(self, chunk: str) -> bool:
+        self.text += chunk
+        for name, marker in self.MARKERS.items():
+            if name in self.spans:
+                continue
+            found = self.text.find(marker, self.search_from[name])
+            if found == -1:
+                self.search_from[name] = max(0, len(self.text) - len(marker))
+                continue
+            self.search_from[name] = found
+            start = self.text.find("{", found + len(marker))
+            script_end = self.text.find("</script>", found)
+            if start != -1 and script_end != -1:
+                self.spans[name] = (start, script_end)
+        if self.api_key is None:
+            match = _API_KEY.search(self.text, self.api_key_from)
+            if match:
+                self.api_key = match.group(1)
+            else:
+                # Keep enough overlap for a match split across chunks
+                self.api_key_from = max(0, len(self.text) - 256)
+        return self.done()
+
+    def done(self) -> bool:
+        return self.api_key is not None and len(self.spans) == len(self.MARKERS)
+
+    def result(self) -> Tuple[dict, str, dict]:
+        if not self.done():
+            # Page layout we don't recognise; fall back to the old sentinels
+            return parse_initial_data(self.text)
+        start, _ = self.spans["client"]
+        # The context sits inside the much larger ytcfg object, so let the
+        # decoder find where it ends
+        client = _decoder.raw_decode(self.text, start)[0]["client"]
+        start, script_end = self.spans["data"]
+        end = self.text.rfind("}", start, script_end) + 1
+        return client, self.api_key, loads(self.text[start:end])
+
+
 def get_initial_data(session: requests.Session, url: str) -> str:
     session.cookies.set("CONSENT", "YES+cb", domain=".youtube.com")
     response = session.get(url)
@@ -204,6 +453,13 @@ def get_initial_data(session: requests.Session, url: str) -> str:
     return html
 
 
+def ajax_payload(next_data: dict, client: dict) -> dict:
+    return {
+        "context": {"clickTracking": next_data["click_params"], "client": client},
+        "continuation": next_data["token"],
+    }
+
+
 def get_ajax_data(
     session: requests.Session,
     api_endpoint: str,
@@ -211,10 +467,7 @@ def get_ajax_data(
     next_data: dict,
     client: dict,
 ) -> dict:
-    data = {
-        "context": {"clickTracking": next_data["click_params"], "client": client},
-        "continuation": next_data["token"],
-    }
+    data = ajax_payload(next_data, client)
     response = session.post(api_endpoint, params={"key": api_key}, json=data)
     return response.json()
 
@@ -227,6 +480,10 @@ def get_json_from_html(html: str, key: str, num_chars: int = 2, stop: str = '"')
 
 def get_next_data(data: dict) -> dict:
     raw_next_data = next(search_dict(data, "continuationEndpoint"), None)
+    return next_data_from(raw_next_data)
+
+
+def next_data_from(raw_next_data: dict) -> dict:
     if not raw_next_data:
         return dict()
     next_data = {
@@ -237,10 +494,47 @@ def get_next_data(data: dict) -> dict:
     return next_data
 
 
+def get_page(data: dict, selector: str) -> Tuple[List[dict], dict]:
+    """Collect every ``selector`` item and the continuation for a page.
+
+    Walks the tree once, breadth first, with the same results as running
+    ``search_dict`` for the selector and for ``continuationEndpoint`` separately:
+    items are in breadth first order, the continuation is the first one found,
+    and neither search looks inside its own matches.
+    """
+
+    items = []
+    raw_next_data = None
+    # Entries are (node, still looking for items, still looking for continuation)
+    queue = deque([(data, True, True)])
+    while queue:
+        current_item, want_items, want_next = queue.popleft()
+        want_next = want_next and raw_next_data is None
+        if not want_items and not want_next:
+            continue
+        if isinstance(current_item, dict):
+            for key, value in current_item.items():
+                if want_items and key == selector:
+                    items.append(value)
+                    if want_next:
+                        queue.append((value, False, True))
+                elif want_next and key == "continuationEndpoint":
+                    if raw_next_data is None:
+                        raw_next_data = value
+                    if want_items:
+                        queue.append((value, True, False))
+                else:
+                    queue.append((value, want_items, want_next))
+        elif isinstance(current_item, list):
+            for value in current_item:
+                queue.append((value, want_items, want_next))
+    return items, next_data_from(raw_next_data)
+
+
 def search_dict(partial: dict, search_key: str) -> Generator[dict, None, None]:
-    stack = [partial]
+    stack = deque([partial])
     while stack:
-        current_item = stack.pop(0)
+        current_item = stack.popleft()
         if isinstance(current_item, dict):
             for key, value in current_item.items():
                 if key == search_key:
@@ -0,0 +1,85 @@
+import os
+import time
+import uuid
+
+import store
+
+# Sermon markdown waiting to be committed to the website repo. Publishing jobs in
+# any process add their file here, and whichever of them gets the site lock once
+# the batch is due commits everything pending in one push, so a backfill or a
+# busy weekend triggers one site rebuild instead of one per sermon. Each entry
+# keeps its own state so every job still learns how its sermon went.
+
+# A batch goes out this many seconds after its oldest entry was added, or as soon
+# as BATCH_SIZE entries are waiting
+WINDOW = float(os.environ.get("SITE_BATCH_WINDOW", "20"))
+BATCH_SIZE = int(os.environ.get("SITE_BATCH_SIZE", "10"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS site_commits (
+    id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    contents TEXT NOT NULL,
+    name TEXT NOT NULL,
+    state TEXT NOT NULL,
+    error TEXT,
+    batch TEXT,
+    queued REAL NOT NULL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS site_commits_state ON site_commits (state, queued);
+"""
+
+INSERT = """
+INSERT INTO site_commits (id, path, contents, name, state, queued)
+VALUES (?, ?, ?, ?, 'pending', ?)
+"""
+GET = "SELECT state, error FROM site_commits WHERE id = ?"
+PENDING = "SELECT COUNT(*), MIN(queued) FROM site_commits WHERE state = 'pending'"
+TAKE = """
+SELECT id, path, contents, name FROM site_commits
+WHERE state = 'pending' ORDER BY queued LIMIT ?
+"""
+FINISH = """
+UPDATE site_commits SET state = ?, error = ?, batch = ?, finished = ? WHERE id = ?
+"""
+
+
+def connect():
+    store.ensure(SCHEMA)
+    return store.connect()
+
+
+# Queue a file for the next batch and return its entry id
+def add(path, contents, name):
+    entry = uuid.uuid4().hex
+    connect().execute(INSERT, (entry, path, contents, name, time.time()))
+    return entry
+
+
+# (state, error) of an entry: pending, done or failed
+def get(entry):
+    return tuple(connect().execute(GET, (entry,)).fetchone())
+
+
+# Whether the pending entries should go out now
+def due():
+    count, oldest = connect().execute(PENDING).fetchone()
+    return bool(count) and (count >= BATCH_SIZE or time.time() - oldest >= WINDOW)
+
+
+# The next batch, oldest first, as (ids, {path: contents}, names). Call with the
+# site lock held so two processes don't take the same entries.
+def take():
+    rows = connect().execute(TAKE, (BATCH_SIZE,)).fetchall()
+    ids = [row[0] for row in rows]
+    files = {row[1]: row[2] for row in rows}
+    names = [row[3] for row in rows]
+    return ids, files, names
+
+
+def finish(ids, error=None):
+    batch = uuid.uuid4().hex
+    state = "failed" if error else "done"
+    now = time.time()
+    connect().executemany(FINISH, [(state, error, batch, now, i) for i in ids])
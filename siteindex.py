@@ -0,0 +1,177 @@
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date as Date
+
+import requests
+from dateutil.parser import parse
+from requests.adapters import HTTPAdapter
+
+# Shared client for the paginated JSON indexes the website publishes under
+# coventrypca.church/assets/data. Every page is cached in memory for TTL seconds
+# and revalidated with ETag/If-Modified-Since afterwards, so a warm lookup makes
+# no network calls and a stale one usually costs a handful of 304s.
+
+BASE_URL = "https://coventrypca.church/assets/data"
+TTL = int(os.environ.get("SITE_INDEX_TTL", "300"))
+# Pages are requested this many at a time since the index doesn't tell us how many exist
+BATCH = 8
+# Hard stop in case the site ever starts answering every page number
+MAX_PAGES = 64
+TIMEOUT = 15
+
+# Index kind -> key the edges live under in the page JSON
+KINDS = {
+    "bulletins": "bulletins",
+    "sermons/all": "sermons",
+}
+
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=BATCH))
+
+_cache = {}
+_lock = threading.Lock()
+_index = None
+_executor = ThreadPoolExecutor(max_workers=BATCH)
+
+
+def pageUrl(kind, num):
+    if num == 1:
+        return f"{BASE_URL}/{kind}/index.json"
+    return f"{BASE_URL}/{kind}/{num}/index.json"
+
+
+# Fetch one page, honouring the TTL and revalidating stale entries. Returns None
+# for pages that don't exist.
+def fetchPage(url, force=False):
+    with _lock:
+        entry = _cache.get(url)
+    now = time.time()
+    if entry and not force and now - entry["fetched"] < TTL:
+        return entry["data"]
+    headers = {}
+    if entry and entry["etag"]:
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry["modified"]:
+        headers["If-Modified-Since"] = entry["modified"]
+    response = session.get(url, headers=headers, timeout=TIMEOUT)
+    if response.status_code == 304 and entry:
+        data = entry["data"]
+    elif response.status_code == 404:
+        data = None
+    else:
+        response.raise_for_status()
+        try:
+            data = response.json()
+        except ValueError:
+            # Static hosts sometimes serve an HTML 404 page with a 200
+            data = None
+    with _lock:
+        _cache[url] = {
+            "fetched": now,
+            "etag": response.headers.get("ETag"),
+            "modified": response.headers.get("Last-Modified"),
+            "data": data,
+        }
+    return data
+
+
+# Fetch every page of an index concurrently, a batch at a time, stopping at the
+# first page that doesn't exist.
+def fetchAll(kind, force=False):
+    key = KINDS[kind]
+    pages = []
+    num = 1
+    while num <= MAX_PAGES:
+        urls = [pageUrl(kind, n) for n in range(num, min(num + BATCH, MAX_PAGES + 1))]
+        results = list(_executor.map(lambda url: fetchPage(url, force), urls))
+        for data in results:
+            if data is None:
+                return pages
+            pages.append(data["data"][key]["edges"])
+        num += BATCH
+    return pages
+
+
+# Flattened list of nodes for an index, in site order
+def nodes(kind, force=False):
+    return [edge["node"] for page in fetchAll(kind, force) for edge in page]
+
+
+def bulletins(force=False):
+    return nodes("bulletins", force)
+
+
+def sermons(force=False):
+    return nodes("sermons/all", force)
+
+
+# Revalidate everything now instead of waiting for the TTL to run out
+def refresh():
+    return index(force=True)
+
+
+# Date keyed view over both indexes so lookups don't rescan every page. Dates are
+# parsed once when the index is built; everything is keyed by ISO YYYY-MM-DD.
+class DateIndex:
+    def __init__(self, bulletin_nodes, sermon_nodes):
+        # ISO date -> bulletin PDF url
+        self.bulletins = {}
+        # ISO date -> date as the site displays it
+        self.labels = {}
+        # ISO date -> sermon record
+        self.sermons = {}
+        for node in bulletin_nodes:
+            iso = parse(node["date"]).strftime("%Y-%m-%d")
+            if iso not in self.bulletins:
+                self.bulletins[iso] = node["url"]
+                self.labels[iso] = node["date"]
+        for node in sermon_nodes:
+            iso = parse(node["date"]).strftime("%Y-%m-%d")
+            self.sermons.setdefault(iso, node)
+        self.dates = sorted(self.bulletins)
+
+    def bulletin(self, date):
+        return self.bulletins.get(date)
+
+    def sermon(self, date):
+        return self.sermons.get(date)
+
+    def isUploaded(self, date):
+        return date in self.sermons
+
+    # Bulletin dates between start and end (inclusive, ISO strings, either may be
+    # None) that have no published sermon. Pass weekday=6 for Sundays only.
+    def missing(self, start=None, end=None, weekday=None):
+        lo = bisect_left(self.dates, start) if start else 0
+        hi = bisect_right(self.dates, end) if end else len(self.dates)
+        found = []
+        for iso in self.dates[lo:hi]:
+            if iso in self.sermons:
+                continue
+            if weekday is not None and Date.fromisoformat(iso).weekday() != weekday:
+                continue
+            found.append(iso)
+        return found
+
+
+# Current date index, rebuilt only when a page actually changed since the last build
+def index(force=False):
+    global _index
+    bulletin_pages = fetchAll("bulletins", force)
+    sermon_pages = fetchAll("sermons/all", force)
+    pages = bulletin_pages + sermon_pages
+    with _lock:
+        current = _index
+    if current and len(current[0]) == len(pages):
+        if all(a is b for a, b in zip(current[0], pages)):
+            return current[1]
+    built = DateIndex(
+        [edge["node"] for page in bulletin_pages for edge in page],
+        [edge["node"] for page in sermon_pages for edge in page],
+    )
+    with _lock:
+        _index = (pages, built)
+    return built
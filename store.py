@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import threading
+
+# Shared SQLite store for the data lists refreshData builds. All gunicorn workers
+# read the same file; WAL mode lets them read while a refresh is writing. Every
+# write bumps a version number so each process can keep the lists cached in
+# memory and only go back to disk once something actually changed.
+
+DB_PATH = os.environ.get("DB_PATH", "data/sermon-api.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS sermons (
+    label TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    position INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sermons_date ON sermons (date);
+CREATE TABLE IF NOT EXISTS series (name TEXT PRIMARY KEY, position INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS speakers (name TEXT PRIMARY KEY, position INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+"""
+
+VERSION = "SELECT value FROM meta WHERE key = 'version'"
+BUMP = "UPDATE meta SET value = value + 1 WHERE key = 'version'"
+SELECT_SERMONS = "SELECT label, date FROM sermons ORDER BY position"
+SELECT_SERIES = "SELECT name FROM series ORDER BY position"
+SELECT_SPEAKERS = "SELECT name FROM speakers ORDER BY position"
+
+_local = threading.local()
+_cache = {}
+_cache_lock = threading.Lock()
+_schemas = set()
+
+
+# One connection per thread; sqlite3 keeps its own statement cache per connection
+def connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        directory = os.path.dirname(DB_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+# Create tables for another module that keeps its data in this store
+def ensure(schema):
+    with _cache_lock:
+        if schema in _schemas:
+            return
+        connect().executescript(schema)
+        _schemas.add(schema)
+
+
+def version():
+    return connect().execute(VERSION).fetchone()[0]
+
+
+# Swap the contents of a list table in a single transaction
+def _replace(table, columns, rows):
+    conn = connect()
+    placeholders = ", ".join("?" for _ in columns)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(f"DELETE FROM {table}")
+        conn.executemany(
+            f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+            rows,
+        )
+        conn.execute(BUMP)
+        conn.execute("COMMIT")
+    except:
+        conn.execute("ROLLBACK")
+        raise
+
+
+# Sermons is a dict of displayed date -> ISO date, kept in the order given
+def setSermons(sermons):
+    rows = [(label, date, num) for num, (label, date) in enumerate(sermons.items())]
+    _replace("sermons", ("label", "date", "position"), rows)
+
+
+def setSeries(series):
+    _replace("series", ("name", "position"), [(s, n) for n, s in enumerate(series)])
+
+
+def setSpeakers(speakers):
+    _replace("speakers", ("name", "position"), [(s, n) for n, s in enumerate(speakers)])
+
+
+# Run a read query, reusing the last result until the store version changes
+def _cached(query, build):
+    current = version()
+    with _cache_lock:
+        hit = _cache.get(query)
+    if hit and hit[0] == current:
+        return hit[1]
+    result = build(connect().execute(query).fetchall())
+    with _cache_lock:
+        _cache[query] = (current, result)
+    return result
+
+
+def getSermons():
+    return _cached(SELECT_SERMONS, lambda rows: {label: date for label, date in rows})
+
+
+def getSeries():
+    return _cached(SELECT_SERIES, lambda rows: [name for (name,) in rows])
+
+
+def getSpeakers():
+    return _cached(SELECT_SPEAKERS, lambda rows: [name for (name,) in rows])
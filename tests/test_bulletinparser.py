@@ -0,0 +1,105 @@
+import glob
+import json
+import os
+
+import pytest
+
+pytest.importorskip("pdfminer")
+
+import bulletinparser
+
+# Regression corpus of front-page text boxes with the details they should parse
+# to (null for bulletins the parser should reject). The boxes are synthetic, hand
+# written to match the shapes pdfminer gives for the bulletin layouts we've seen,
+# with placeholder names; the PDF tests below run the layout analysis itself.
+CORPUS = os.path.join(os.path.dirname(__file__), "fixtures", "bulletins")
+FIXTURES = sorted(glob.glob(os.path.join(CORPUS, "*.json")))
+
+
+@pytest.mark.parametrize("path", FIXTURES, ids=os.path.basename)
+def test_fixture(path):
+    with open(path) as f:
+        fixture = json.load(f)
+    assert bulletinparser.fromBoxes(fixture["boxes"]) == fixture["expected"]
+
+
+def test_blank_title_falls_back_to_whole_page():
+    boxes = ["Sermon ", "The Good Shepherd ", "Text: John 10:1-18 ", "Pastor Jo Smith "]
+    relevant = " ".join(box for box in boxes if bulletinparser.LABELS.search(box))
+    assert bulletinparser.fields(relevant) is None
+    assert bulletinparser.fromBoxes(boxes) == {
+        "title": "The Good Shepherd",
+        "passage": "John 10:1-18",
+        "speaker": "Jo Smith",
+    }
+
+
+# A one page PDF with each (x, y, text) line set in 11pt Helvetica
+def pdf(lines):
+    text = "".join(
+        f"BT /F1 11 Tf {x} {y} Td ({line}) Tj ET\n" for x, y, line in lines
+    ).encode("latin-1")
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+        b"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Length %d >>\nstream\n%s\nendstream" % (len(text), text),
+    ]
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\n" % (len(objects) + 1)
+    out += b"startxref\n%d\n%%%%EOF\n" % xref
+    return out
+
+
+HEADER = [
+    (180, 740, "Presbyterian Church of Coventry"),
+    (220, 722, "Lord's Day Worship"),
+]
+
+
+def test_pdf_labelled_block():
+    content = pdf(
+        HEADER
+        + [
+            (72, 600, "Call to Worship"),
+            (72, 520, "Sermon The Good Shepherd"),
+            (72, 507, "Text: John 10:1-18"),
+            (72, 494, "Pastor Jo Smith"),
+            (72, 400, "Benediction"),
+        ]
+    )
+    assert bulletinparser.extract(content) == {
+        "title": "The Good Shepherd",
+        "passage": "John 10:1-18",
+        "speaker": "Jo Smith",
+    }
+
+
+def test_pdf_title_in_its_own_box():
+    content = pdf(
+        HEADER
+        + [
+            (72, 560, "Sermon"),
+            (72, 500, "The Good Shepherd"),
+            (72, 440, "Text: John 10:1-18"),
+            (72, 380, "Pastor Jo Smith"),
+        ]
+    )
+    texts = bulletinparser.boxes(content)
+    assert "The Good Shepherd " in texts
+    assert bulletinparser.extract(content)["title"] == "The Good Shepherd"
+
+
+def test_pdf_without_sermon_is_rejected():
+    content = pdf(HEADER + [(72, 600, "Congregational Meeting")])
+    with pytest.raises(bulletinparser.BulletinFormatError):
+        bulletinparser.extract(content)
@@ -0,0 +1,82 @@
+import hashlib
+
+import pytest
+
+moto = pytest.importorskip("moto")
+boto3 = pytest.importorskip("boto3")
+upload = pytest.importorskip("upload")
+
+# mock_s3 was folded into mock_aws in moto 5
+mock = getattr(moto, "mock_aws", None) or moto.mock_s3
+
+
+@pytest.fixture
+def bucket(monkeypatch, tmp_path):
+    # log() appends to logs/app.log under the working directory
+    (tmp_path / "logs").mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("S3_ACCESS_KEY", "testing")
+    monkeypatch.setenv("S3_SECRET", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    # moto only answers for the AWS endpoints, and the shared client has to be
+    # rebuilt inside the mock
+    monkeypatch.setattr(upload, "S3_ENDPOINT", None)
+    monkeypatch.setattr(upload, "_s3", None)
+    with mock():
+        upload.s3Client().create_bucket(Bucket=upload.S3_BUCKET)
+        yield upload.s3Client()
+
+
+def mp3(tmp_path, size):
+    path = tmp_path / "2024-01-07.mp3"
+    path.write_bytes(bytes(i % 251 for i in range(size)))
+    return str(path)
+
+
+def etag(client, file):
+    key = "sermons/" + file.split("/")[-1]
+    return client.head_object(Bucket=upload.S3_BUCKET, Key=key)["ETag"].strip('"')
+
+
+def test_single_part_etag_is_plain_md5(bucket, tmp_path):
+    file = mp3(tmp_path, 1024)
+    assert upload.wasabi(file) == upload.S3_PUBLIC + "sermons/2024-01-07.mp3"
+    with open(file, "rb") as f:
+        assert upload.s3ETag(file) == hashlib.md5(f.read()).hexdigest()
+    assert etag(bucket, file) == upload.s3ETag(file)
+
+
+def test_multipart_etag(bucket, tmp_path):
+    file = mp3(tmp_path, 2 * upload.S3_CHUNK + 1024)
+    upload.wasabi(file)
+    assert upload.s3ETag(file).endswith("-3")
+    assert etag(bucket, file) == upload.s3ETag(file)
+
+
+def test_exactly_one_chunk_is_a_one_part_upload(bucket, tmp_path):
+    file = mp3(tmp_path, upload.S3_CHUNK)
+    upload.wasabi(file)
+    assert upload.s3ETag(file).endswith("-1")
+    assert etag(bucket, file) == upload.s3ETag(file)
+
+
+def test_skips_upload_when_etag_matches(bucket, tmp_path, monkeypatch):
+    file = mp3(tmp_path, 1024)
+    upload.wasabi(file)
+    assert upload.s3Matches("sermons/2024-01-07.mp3", file)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("uploaded again")
+
+    monkeypatch.setattr(bucket, "upload_file", fail)
+    assert upload.wasabi(file) == upload.S3_PUBLIC + "sermons/2024-01-07.mp3"
+
+
+def test_uploads_when_contents_changed(bucket, tmp_path):
+    file = mp3(tmp_path, 1024)
+    upload.wasabi(file)
+    with open(file, "ab") as f:
+        f.write(b"more")
+    assert not upload.s3Matches("sermons/2024-01-07.mp3", file)
+    upload.wasabi(file)
+    assert etag(bucket, file) == upload.s3ETag(file)
@@ -0,0 +1,67 @@
+from collections import namedtuple
+
+# Finds where the sermon starts and ends in a livestream transcript in a single
+# pass. The sermon starts after the last "amen, please be seated" and ends at
+# the first closing marker inside that marker's time window, as long as the
+# congregation wasn't seated again in between (which means we started too early).
+
+# Times are in seconds
+Timing = namedtuple("Timing", "start end confidence")
+
+# Fallbacks when the transcript gives us nothing to go on
+DEFAULT_START = 20 * 60
+DEFAULT_END = 50 * 60
+
+START_PHRASES = ("amen please be",)
+RESET_PHRASES = ("please be seated",)
+# Closing marker -> (min seconds after start, max seconds after start, which
+# event relative to the marker the sermon ends on, confidence when it matches)
+END_MARKERS = {
+    "name amen": (20 * 60, 40 * 60, 1, 0.9),
+    "closing hymn": (20 * 60, 45 * 60, -2, 0.8),
+}
+# Confidence when only the start was found
+START_ONLY = 0.4
+
+
+# Pair each caption with the next one so phrases split across captions still match
+def events(transcript):
+    return [
+        (current["start"], current["text"] + " " + following["text"])
+        for current, following in zip(transcript, transcript[1:])
+    ]
+
+
+def scan(
+    transcript,
+    start_phrases=START_PHRASES,
+    reset_phrases=RESET_PHRASES,
+    end_markers=END_MARKERS,
+):
+    evts = events(transcript or [])
+    start = None
+    start_index = None
+    # Index of the latest event mentioning a reset phrase
+    last_reset = -1
+    # The last event only serves as lookahead for the one before it
+    for i in range(len(evts) - 1):
+        time, text = evts[i]
+        if any(phrase in text for phrase in start_phrases):
+            start = time
+            start_index = i
+        elif start is not None:
+            for marker, (low, high, offset, confidence) in end_markers.items():
+                if marker not in text:
+                    continue
+                if not low <= time - start <= high:
+                    break
+                # The event right after the start usually repeats the start
+                # phrase, so only resets after that one count
+                if last_reset >= start_index + 2:
+                    break
+                return Timing(start, evts[i + offset][0], confidence)
+        if any(phrase in text for phrase in reset_phrases):
+            last_reset = i
+    if start is not None:
+        return Timing(start, DEFAULT_END, START_ONLY)
+    return Timing(DEFAULT_START, DEFAULT_END, 0.0)
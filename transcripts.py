@@ -0,0 +1,122 @@
+import gzip
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from youtube_transcript_api import CouldNotRetrieveTranscript, YouTubeTranscriptApi
+
+# On-disk cache of livestream transcripts, one gzipped JSON file per video id.
+# Hits bump the file's mtime and eviction drops the least recently used files
+# once the cache grows past its size limit. Videos with no transcript get an empty
+# marker file instead, trusted for a short while since Youtube may still be
+# generating the captions.
+
+CACHE_DIR = os.environ.get("TRANSCRIPT_CACHE", "data/transcripts")
+MAX_BYTES = int(os.environ.get("TRANSCRIPT_CACHE_MB", "50")) * 1024 * 1024
+MISSING_TTL = int(os.environ.get("TRANSCRIPT_MISSING_TTL", "3600"))
+
+_lock = threading.Lock()
+
+
+class TranscriptMissing(Exception):
+    pass
+
+
+def path(video_id):
+    return os.path.join(CACHE_DIR, video_id + ".json.gz")
+
+
+def missingPath(video_id):
+    return os.path.join(CACHE_DIR, video_id + ".missing")
+
+
+# Whether a lookup in the last MISSING_TTL seconds found no transcript
+def knownMissing(video_id):
+    try:
+        return time.time() - os.path.getmtime(missingPath(video_id)) < MISSING_TTL
+    except OSError:
+        return False
+
+
+def saveMissing(video_id):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(missingPath(video_id), "w"):
+        pass
+
+
+def cached(video_id):
+    try:
+        with gzip.open(path(video_id), "rt") as f:
+            transcript = json.load(f)
+    except (OSError, ValueError):
+        return None
+    try:
+        os.utime(path(video_id))
+    except OSError:
+        pass
+    return transcript
+
+
+def save(video_id, transcript):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Write to a temp file and rename so readers never see a half written file
+    temp = path(video_id) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+    with gzip.open(temp, "wt") as f:
+        json.dump(transcript, f)
+    os.replace(temp, path(video_id))
+    evict()
+
+
+# Drop least recently used transcripts until the cache fits in MAX_BYTES
+def evict():
+    with _lock:
+        files = []
+        for entry in os.scandir(CACHE_DIR):
+            if entry.name.endswith(".json.gz"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, file in sorted(files):
+            if total <= MAX_BYTES:
+                break
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+            total -= size
+
+
+# Transcript for a video, from the cache if we have it. Raises whatever
+# YouTubeTranscriptApi raises when the video has no transcript, or
+# TranscriptMissing if it had none a moment ago.
+def get(video_id):
+    transcript = cached(video_id)
+    if transcript is not None:
+        return transcript
+    if knownMissing(video_id):
+        raise TranscriptMissing(video_id)
+    try:
+        transcript = YouTubeTranscriptApi.get_transcript(video_id)
+    except CouldNotRetrieveTranscript:
+        saveMissing(video_id)
+        raise
+    save(video_id, transcript)
+    try:
+        os.remove(missingPath(video_id))
+    except OSError:
+        pass
+    return transcript
+
+
+# Warm the cache for a batch of videos; missing transcripts are skipped
+def prefetch(video_ids, workers=4):
+    def fetch(video_id):
+        try:
+            get(video_id)
+        except Exception:
+            pass
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(fetch, video_ids))
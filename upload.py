@@ -1,21 +1,41 @@
+import fcntl
+import hashlib
+import http.client
+import json
 import os
+import random
+import shutil
+import socket
+import ssl
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from time import sleep
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import ClientError
 import pickle
 import sermonaudio as sapy
 from dotenv import load_dotenv
+from git.exc import GitCommandError
 from git.repo import Repo
 from git.util import Actor
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 import google_auth_oauthlib.flow
+import httplib2
 import googleapiclient.discovery
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload
 from sermonaudio.broadcaster.requests import Broadcaster
 from sermonaudio.models import SermonEventType
 
+import ledger
+import quota
+import sitebatch
+
 load_dotenv()
 
 
@@ -25,104 +45,239 @@ def log(msg):
         f.write(msg)
 
 
-# Upload sermon markdown to Git and thus website
-def git(title, text, speaker, series, date, audio, video):
-    log("Uploading to Git...")
-    try:
-        # Needed stuff
-        repo_url = os.environ["REPO_URL"]
-        user = os.environ["GIT_USER"]
-        email = os.environ["GIT_EMAIL"]
-        password = os.environ["GIT_PASS"]
-        repo_access = "https://" + user + ":" + password + "@" + repo_url.split("//")[1]
-        repo_path = repo_url.split("/")[-1]
-        author = Actor(user, email)
+# Persistent shallow clone of the website repo, shared by every upload job. A
+# file lock serialises jobs across threads and gunicorn workers while they use it.
+SITE_DIR = os.environ.get("SITE_REPO_DIR", "data/site")
+SITE_LOCK = SITE_DIR + ".lock"
+PUSH_ATTEMPTS = 5
+PUSH_BACKOFF = 2
+PUSH_BACKOFF_MAX = 60
+# How often a publishing job checks on its sermon's batch
+SITE_POLL = 1
+
+
+def siteAccess():
+    repo_url = os.environ["REPO_URL"]
+    user = os.environ["GIT_USER"]
+    password = os.environ["GIT_PASS"]
+    return "https://" + user + ":" + password + "@" + repo_url.split("//")[1]
+
+
+# Bring the working copy up to the remote's tip, cloning it the first time. Only
+# the newest commit is fetched, and any leftovers from a failed run are dropped.
+# The clone stays on disk, so origin is kept without credentials and the access
+# URL is only ever passed on the command line.
+def syncSite():
+    if not os.path.isdir(os.path.join(SITE_DIR, ".git")):
+        shutil.rmtree(SITE_DIR, ignore_errors=True)
+        repo = Repo.clone_from(siteAccess(), SITE_DIR, depth=1)
+        repo.remotes.origin.set_url(os.environ["REPO_URL"])
+        return repo
+    repo = Repo(SITE_DIR)
+    repo.remotes.origin.set_url(os.environ["REPO_URL"])
+    repo.git.fetch(siteAccess(), repo.active_branch.name, depth=1)
+    repo.git.reset("--hard", "FETCH_HEAD")
+    repo.git.clean("-fd")
+    return repo
+
+
+@contextmanager
+def siteLock():
+    os.makedirs(os.path.dirname(SITE_LOCK) or ".", exist_ok=True)
+    with open(SITE_LOCK, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+# Whether a push failed only because someone else pushed first. Anything else,
+# like a bad password or no network, won't get better by trying again.
+def pushRejected(error):
+    stderr = str(error.stderr)
+    return any(s in stderr for s in ("[rejected]", "fetch first", "non-fast-forward"))
+
+
+# Commit files ({path in repo: contents}) to the website repo and push, with the
+# site lock held. If the push is rejected because someone else pushed first,
+# start again from the new tip, backing off a little longer each time.
+def commitSite(files, message):
+    author = Actor(os.environ["GIT_USER"], os.environ["GIT_EMAIL"])
+    for attempt in range(PUSH_ATTEMPTS):
+        repo = syncSite()
+        for path, contents in files.items():
+            with open(os.path.join(SITE_DIR, path), "w") as f:
+                f.write(contents)
+        # repo.index.add() would chdir the whole process into the clone while
+        # other jobs' threads use relative paths; git add runs with its own cwd
+        repo.git.add(*files)
+        if not repo.git.diff("--cached", "--name-only"):
+            # Already there, e.g. a retry of a push that went through
+            return
+        repo.index.commit(message, author=author, committer=author)
+        try:
+            repo.git.push(siteAccess(), "HEAD:" + repo.active_branch.name)
+            return
+        except GitCommandError as e:
+            if not pushRejected(e) or attempt == PUSH_ATTEMPTS - 1:
+                raise
+            delay = min(PUSH_BACKOFF * 2**attempt, PUSH_BACKOFF_MAX)
+            sleep(delay * random.uniform(0.5, 1))
+
+
+def pushSite(files, message):
+    with siteLock():
+        commitSite(files, message)
+
+
+# Commit and push whatever sermons are waiting in sitebatch as one commit
+def pushBatch():
+    with siteLock():
+        ids, files, names = sitebatch.take()
+        if not ids:
+            return
+        if len(names) == 1:
+            message = f'Create Sermon "{names[0]}"'
+        else:
+            message = "Create Sermons " + ", ".join(f'"{n}"' for n in names)
         try:
-            series = series.lower().replace(" ", "-")
-        except:
-            series = None
-        speaker = speaker.lower().replace(" ", "-")
-        # Generate Markdown for sermon
-        md = f"""---
+            commitSite(files, message)
+        except Exception as e:
+            sitebatch.finish(ids, str(e) or type(e).__name__)
+            raise
+        sitebatch.finish(ids)
+
+
+# Website markdown for a sermon as (path in repo, contents)
+def sermonMarkdown(title, text, speaker, series, date, audio, video):
+    try:
+        series = series.lower().replace(" ", "-")
+    except:
+        series = None
+    speaker = speaker.lower().replace(" ", "-")
+    # Generate Markdown for sermon
+    md = f"""---
 title: {title}
 """
-        if series:
-            md += f"""series: {series}
+    if series:
+        md += f"""series: {series}
 """
-        md += f"""preacher: {speaker}
+    md += f"""preacher: {speaker}
 date: {date}
 scripture: {text}
 audio: {audio}
 """
-        if video:
-            md += f"""video: {video}
+    if video:
+        md += f"""video: {video}
 ---
 """
-        else:
-            md += """---
+    else:
+        md += """---
 """
-        # Create filename
-        title = title.split(" ")
-        hyphen_title = ""
-        for i in title:
-            hyphen_title += i + "-"
-        hyphen_title = hyphen_title[:-1]
-        filename = date[:-3] + "-" + hyphen_title + ".md"
-        # Remove existing repo if it still exists instead of risking a pull
-        os.system("rm -rf " + repo_path)
-        # Clone repo from remote
-        Repo.clone_from(repo_access, repo_path)
-        # Write Markdown for sermon in cloned repo
-        file = open(repo_path + "/content/sermons/" + filename, "w")
-        file.write(md)
-        file.close()
-        # Initialize repo
-        repo = Repo(repo_path)
-        # Commit sermon Markdown
-        repo.index.add("content/sermons/" + filename)
-        repo.index.commit(
-            f'Create Sermon "{filename[:-3]}"', author=author, committer=author
-        )
-        # Make remote if it doesn't exist
-        try:
-            repo.create_remote("origin", repo_access)
-        except:
-            pass
-        origin = repo.remotes.origin
-        # Push commit to remote
-        origin.push()
-        # Clean up for next time
-        os.system("rm -rf " + repo_path)
+    # Create filename
+    filename = date[:-3] + "-" + "-".join(title.split(" ")) + ".md"
+    return "content/sermons/" + filename, md
+
+
+# Upload sermon markdown to Git and thus website. The file joins the next batch
+# of sermon commits; this returns once the batch holding it has been pushed.
+def git(title, text, speaker, series, date, audio, video):
+    log("Uploading to Git...")
+    try:
+        path, md = sermonMarkdown(title, text, speaker, series, date, audio, video)
+        entry = sitebatch.add(path, md, os.path.basename(path)[:-3])
+        while True:
+            state, error = sitebatch.get(entry)
+            if state != "pending":
+                break
+            if not sitebatch.due():
+                sleep(SITE_POLL)
+                continue
+            try:
+                pushBatch()
+            except Exception:
+                # Our entry's state says whether this was our batch
+                pass
+        if state == "failed":
+            raise EnvironmentError(error)
         log("✅\n")
+        return True
     except:
         log("❌\n")
+        return False
+
+
+# Wasabi / S3. One client is built on first use and shared by every upload; it is
+# thread safe and keeps its connection pool and credentials between sermons.
+S3_ENDPOINT = "https://s3.us-east-1.wasabisys.com"
+S3_BUCKET = "coventrypca.church"
+S3_PUBLIC = "https://s3.wasabisys.com/coventrypca.church/"
+S3_CHUNK = 8 * 1024 * 1024
+S3_TRANSFER = TransferConfig(
+    multipart_threshold=S3_CHUNK,
+    multipart_chunksize=S3_CHUNK,
+    max_concurrency=8,
+    use_threads=True,
+)
 
+_s3 = None
+_s3_lock = threading.Lock()
 
-# Upload audio to Wasabi:
-def wasabi(file):
+
+def s3Client():
+    global _s3
+    with _s3_lock:
+        if _s3 is None:
+            _s3 = boto3.client(
+                "s3",
+                endpoint_url=S3_ENDPOINT,
+                aws_access_key_id=os.environ["S3_ACCESS_KEY"],
+                aws_secret_access_key=os.environ["S3_SECRET"],
+                config=BotoConfig(max_pool_connections=S3_TRANSFER.max_concurrency),
+            )
+        return _s3
+
+
+# The ETag S3 gives a file uploaded with S3_TRANSFER: the MD5 of the file, or
+# for a multipart upload the MD5 of the parts' MD5s and the number of parts
+def s3ETag(file):
+    parts = []
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(S3_CHUNK), b""):
+            parts.append(hashlib.md5(chunk).digest())
+    if not parts:
+        return hashlib.md5(b"").hexdigest()
+    if len(parts) == 1 and os.path.getsize(file) < S3_TRANSFER.multipart_threshold:
+        return parts[0].hex()
+    return hashlib.md5(b"".join(parts)).hexdigest() + f"-{len(parts)}"
+
+
+# Whether key already holds exactly this file
+def s3Matches(key, file):
+    try:
+        head = s3Client().head_object(Bucket=S3_BUCKET, Key=key)
+    except ClientError:
+        return False
+    return head["ETag"].strip('"') == s3ETag(file)
+
+
+# Upload audio to Wasabi. callback, if given, is called with the number of bytes
+# sent each time a chunk goes up (from several threads at once).
+def wasabi(file, callback=None):
     log("Uploading to Wasabi...")
     try:
-        api = os.environ["S3_ACCESS_KEY"]
-        secret = os.environ["S3_SECRET"]
-        # Connect to Wasabi / S3
-        s3 = boto3.resource(
-            "s3",
-            endpoint_url="https://s3.us-east-1.wasabisys.com",
-            aws_access_key_id=api,
-            aws_secret_access_key=secret,
-        )
-        # Get bucket as object
-        bucket = s3.Bucket("coventrypca.church")
-        # Upload the file
-        bucket.upload_file(
+        key = f"sermons/{file.split('/')[-1]}"
+        if s3Matches(key, file):
+            log("already there ✅\n")
+            return S3_PUBLIC + key
+        s3Client().upload_file(
             file,
-            f"sermons/{file.split('/')[-1]}",
+            S3_BUCKET,
+            key,
             ExtraArgs={"ContentType": "audio/mpeg", "ContentDisposition": "inline"},
+            Config=S3_TRANSFER,
+            Callback=callback,
         )
         log("✅\n")
-        return (
-            "https://s3.wasabisys.com/coventrypca.church/sermons/" + file.split("/")[-1]
-        )
+        return S3_PUBLIC + key
     except:
         log("❌\n")
 
@@ -179,13 +334,86 @@ def getAuthenticatedService():
     return googleapiclient.discovery.build("youtube", "v3", credentials=credentials)
 
 
+# Youtube uploads go up in YOUTUBE_CHUNK pieces through a resumable session. The
+# session URI is saved under YOUTUBE_SESSIONS, keyed by the video's SHA-256, as
+# soon as Youtube hands it out, so if a worker dies mid-upload the retry asks
+# Youtube how far it got and carries on from there instead of from byte 0.
+YOUTUBE_CHUNK = 8 * 1024 * 1024
+YOUTUBE_SESSIONS = "data/youtube-sessions"
+YOUTUBE_RETRIES = 8
+YOUTUBE_BACKOFF = 1
+YOUTUBE_BACKOFF_MAX = 60
+# Server side hiccups worth retrying; anything else from the API is final
+TRANSIENT_STATUS = (500, 502, 503, 504)
+TRANSIENT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded", "backendError")
+QUOTA_REASONS = ("quotaExceeded", "dailyLimitExceeded", "uploadLimitExceeded")
+# Dropped connections and timeouts below the API; any other exception is a bug or a
+# bad file and retrying won't help
+TRANSIENT_ERRORS = (
+    ConnectionError,
+    socket.timeout,
+    ssl.SSLError,
+    http.client.HTTPException,
+    httplib2.HttpLib2Error,
+)
+
+
+def youtubeSession(digest):
+    return os.path.join(YOUTUBE_SESSIONS, digest + ".json")
+
+
+def loadYoutubeSession(digest):
+    try:
+        with open(youtubeSession(digest)) as f:
+            return json.load(f)["uri"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def saveYoutubeSession(digest, uri):
+    os.makedirs(YOUTUBE_SESSIONS, exist_ok=True)
+    temp = youtubeSession(digest) + ".tmp"
+    with open(temp, "w") as f:
+        json.dump({"uri": uri, "saved": datetime.now().isoformat()}, f)
+    os.replace(temp, youtubeSession(digest))
+
+
+def dropYoutubeSession(digest):
+    try:
+        os.remove(youtubeSession(digest))
+    except OSError:
+        pass
+
+
+# "transient", "quota", "expired" (the saved session is gone) or "fatal"
+def youtubeError(error):
+    if not isinstance(error, HttpError):
+        return "transient" if isinstance(error, TRANSIENT_ERRORS) else "fatal"
+    status = error.resp.status
+    try:
+        reason = json.loads(error.content)["error"]["errors"][0]["reason"]
+    except (ValueError, KeyError, IndexError, TypeError):
+        reason = None
+    if reason in QUOTA_REASONS:
+        return "quota"
+    if status in TRANSIENT_STATUS or reason in TRANSIENT_REASONS:
+        return "transient"
+    if status in (404, 410):
+        return "expired"
+    return "fatal"
+
+
+def backoff(retry):
+    # Full jitter: anywhere up to the capped exponential delay
+    return random.uniform(0, min(YOUTUBE_BACKOFF * 2**retry, YOUTUBE_BACKOFF_MAX))
+
+
 # Youtube upload function: Bit of a mess, but it works so I'm not complaining! This took ages to figure out.
-def youtube(auth, file, title, text, speaker, date):
+# callback, if given, is called with the number of bytes sent after each chunk.
+# digest is the file's ledger.fileHash(), if the caller already has it.
+def youtube(auth, file, title, text, speaker, date, callback=None, digest=None):
     log("Uploading to Youtube...")
     try:
-        response = None
-        error = None
-        retry = 0
         # Pretty date
         parts = date.split("-")
         pdate = parts[1].lstrip("0") + "/" + parts[2].lstrip("0") + "/" + parts[0][-2:]
@@ -211,35 +439,68 @@ def youtube(auth, file, title, text, speaker, date):
                 # locationDescription='Coventry, CT' # Deprecated in newer API
             ),
         )
+        # The saved session is keyed on the file's contents
+        digest = digest or ledger.fileHash(file)
         insert_request = auth.videos().insert(
             part=",".join(body.keys()),
             body=body,
-            media_body=MediaFileUpload(file, chunksize=-1, resumable=True),
+            media_body=MediaFileUpload(file, chunksize=YOUTUBE_CHUNK, resumable=True),
         )
-        # Retries
+        saved = loadYoutubeSession(digest)
+        if saved:
+            # Ask Youtube how much of this session it has before sending more.
+            # googleapiclient has no public way to resume a saved session; setting
+            # _in_error_state makes next_chunk() query the upload status first.
+            # Checked against google-api-python-client 2.51.0 (requirements.txt),
+            # recheck when upgrading.
+            insert_request.resumable_uri = saved
+            insert_request._in_error_state = True
+        sent = 0
+        retry = 0
+        response = None
         while response is None:
             try:
-                response = insert_request.next_chunk()
-                if response is not None:
-                    if "id" in response[1]:
-                        video_id = response[1]["id"]
-                        log("✅\n")
-                        return "https://youtu.be/" + video_id
-                    else:
-                        log("❌\n")
-                        log(str(response) + "\n")
-                        return False
-            except:
-                error = "exists"
-                # A video upload costs 1600 "units," and each account gets 10000 "units" a day.
-                # Repeated uploads hit this, so if there are errors that's probably it.
-            if error is not None:
-                retry += 1
-                if retry > 10:
+                status, response = insert_request.next_chunk()
+            except Exception as e:
+                kind = youtubeError(e)
+                if kind == "expired":
+                    # The saved session ran out; start a new one from the top
+                    dropYoutubeSession(digest)
+                    saved = None
+                    insert_request.resumable_uri = None
+                    insert_request.resumable_progress = 0
+                    # Same private flag as above, pinned to 2.51.0
+                    insert_request._in_error_state = False
+                    sent = 0
+                    continue
+                if kind == "quota":
+                    # A video upload costs 1600 "units," and each account gets 10000 "units" a day.
+                    quota.exhaust()
+                    log("❌\nYoutube quota exceeded for today\n")
+                    return False
+                if kind == "fatal" or retry >= YOUTUBE_RETRIES:
                     log("❌\n")
-                    log(str(error) + "\n")
+                    log(str(e) + "\n")
                     return False
-            max_sleep = 2**retry
-            sleep(max_sleep)
+                sleep(backoff(retry))
+                retry += 1
+                continue
+            retry = 0
+            if insert_request.resumable_uri and not saved:
+                saved = insert_request.resumable_uri
+                saveYoutubeSession(digest, saved)
+            done = insert_request.resumable_progress
+            if response is not None:
+                done = os.path.getsize(file)
+            if callback and done > sent:
+                callback(done - sent)
+            sent = done
+        dropYoutubeSession(digest)
+        if "id" in response:
+            log("✅\n")
+            return "https://youtu.be/" + response["id"]
+        log("❌\n")
+        log(str(response) + "\n")
+        return False
     except:
         log("❌\n")